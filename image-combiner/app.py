@@ -1,61 +1,1639 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import wrap_file
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 import io
 import os
 import gzip
 import hashlib
 import json
-from typing import List, Optional
+import time
+import threading
+import math
+import queue
+import random
+import re
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import multiprocessing
+import sys
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+from typing import Any, Dict, List, Optional, Tuple
 import redis
 from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+
+# Codecs opcionais para o cache
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
 
 app = Flask(__name__)
 
+# Logging: os registros entram em uma fila e são escritos por uma thread
+# separada (QueueListener), sem bloquear a thread da requisição. Hits e misses
+# do cache usam o logger "access", amostrado por log_sample_rate.
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+SECRET_FIELDS = ('password', 'token', 'secret', 'api_key')
+_SECRET_PATTERN = re.compile(
+    r"(?i)((?:%s)\w*['\"]?\s*[:=]\s*['\"]?)([^'\"\s,}&]+)" % '|'.join(SECRET_FIELDS)
+)
+_URL_CREDENTIALS = re.compile(r'(://[^/\s:@]+:)[^/\s@]+@')
+
+logger = logging.getLogger('image_combiner')
+access_logger = logging.getLogger('image_combiner.access')
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def redact(text: str) -> str:
+    """Mascara senhas, tokens e credenciais em URLs"""
+    return _URL_CREDENTIALS.sub(r'\1***@', _SECRET_PATTERN.sub(r'\1***', text))
+
+
+def redact_config(config: dict) -> dict:
+    """Cópia da configuração com os campos sensíveis mascarados"""
+    redacted = {}
+    for name, value in config.items():
+        if any(field in name.lower() for field in SECRET_FIELDS):
+            redacted[name] = '***' if value else value
+        elif isinstance(value, str):
+            redacted[name] = redact(value)
+        else:
+            redacted[name] = value
+    return redacted
+
+
+class RedactFilter(logging.Filter):
+    """Remove segredos da mensagem (executa na thread do QueueListener)"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Deixa passar apenas uma fração dos registros"""
+    
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+_access_sampler = SampleFilter()
+access_logger.addFilter(_access_sampler)
+
+
+def setup_logging(level: str = 'info', sample_rate: float = 1.0):
+    """Configura o nível e a amostragem; na primeira chamada inicia o QueueListener"""
+    global _log_listener
+    if _log_listener is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(RedactFilter())
+        log_queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        logger.propagate = False
+    logger.setLevel(level.upper() if level in LOG_LEVELS else logging.INFO)
+    _access_sampler.rate = sample_rate
+
+
+setup_logging(os.getenv('LOG_LEVEL', 'info'), float(os.getenv('LOG_SAMPLE_RATE', 0.01)))
+
+# Métricas Prometheus. Com vários workers (gunicorn), PROMETHEUS_MULTIPROC_DIR
+# é definido no gunicorn.conf.py e /metrics agrega todos os processos.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_SECONDS = Histogram(
+    'image_combiner_stage_seconds', 'Duração de cada etapa do pipeline',
+    ['stage'], buckets=LATENCY_BUCKETS
+)
+DOWNLOAD_SECONDS = Histogram(
+    'image_combiner_download_seconds', 'Duração do download de cada imagem de origem',
+    ['host'], buckets=LATENCY_BUCKETS
+)
+REDIS_SECONDS = Histogram(
+    'image_combiner_redis_seconds', 'Duração de cada ida e volta ao Redis',
+    ['operation'], buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'image_combiner_cache_requests_total', 'Consultas ao cache por camada e resultado',
+    ['tier', 'result']
+)
+ERRORS = Counter(
+    'image_combiner_errors_total', 'Erros por etapa',
+    ['stage']
+)
+SOURCE_BYTES = Counter('image_combiner_source_bytes_total', 'Bytes baixados das origens')
+OUTPUT_BYTES = Counter(
+    'image_combiner_output_bytes_total', 'Bytes das imagens combinadas geradas',
+    ['format']
+)
+REQUEST_PEAK_BYTES = Histogram(
+    'image_combiner_request_peak_memory_bytes', 'Pico estimado de memória de cada renderização',
+    buckets=(1 << 20, 4 << 20, 16 << 20, 32 << 20, 64 << 20, 128 << 20, 256 << 20, 512 << 20, 1 << 30)
+)
+IN_FLIGHT = Gauge(
+    'image_combiner_in_flight_requests', 'Requisições /combine em andamento',
+    multiprocess_mode='livesum'
+)
+
+# Níveis de qualidade do redimensionamento:
+# - draft_gap: quanto maior que a célula a imagem é decodificada (JPEG draft) e
+#   reduzida com Image.reduce antes do filtro final (None = resolução total)
+# - filter: filtro usado no redimensionamento final
+RESAMPLE_TIERS = {
+    'fast': {'draft_gap': 1.0, 'filter': Image.Resampling.BILINEAR},
+    'balanced': {'draft_gap': 2.0, 'filter': Image.Resampling.LANCZOS},
+    'best': {'draft_gap': None, 'filter': Image.Resampling.LANCZOS},
+}
+DEFAULT_RESAMPLE = 'balanced'
+
+# Layout da grade: até MAX_TILES células por imagem combinada
+MAX_TILES = 16
+MAX_OUTPUT_SIZE = 4096
+FIT_MODES = ('contain', 'cover')
+
+# Plugin opcional que adiciona AVIF ao Pillow
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Formatos de saída. JPEG é a variante base da chave; os demais são
+# armazenados em "<chave>.<extensão>"
+OUTPUT_FORMATS = {
+    'jpeg': {'pil_format': 'JPEG', 'mimetype': 'image/jpeg', 'extension': 'jpg'},
+    'webp': {'pil_format': 'WEBP', 'mimetype': 'image/webp', 'extension': 'webp'},
+    'avif': {'pil_format': 'AVIF', 'mimetype': 'image/avif', 'extension': 'avif'},
+}
+DEFAULT_FORMAT = 'jpeg'
+JPEG_MODES = ('baseline', 'optimized', 'progressive')
+
+def host_label(url: str) -> str:
+    """Host (e porta, se explícita) da URL para rótulos de métricas, sem usuário e senha"""
+    parts = urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    host = parts.hostname or 'unknown'
+    return f"{host}:{port}" if port else host
+
+def available_formats() -> List[str]:
+    """Formatos de saída suportados pelo Pillow instalado"""
+    Image.init()
+    return [fmt for fmt, spec in OUTPUT_FORMATS.items() if spec['pil_format'] in Image.SAVE]
+
+def variant_key(base_key: str, fmt: str) -> str:
+    """Chave da variante de formato derivada da chave base"""
+    if fmt == DEFAULT_FORMAT:
+        return base_key
+    return f"{base_key}.{OUTPUT_FORMATS[fmt]['extension']}"
+
+def format_from_key(key: str) -> str:
+    """Formato da imagem armazenada na chave, pela extensão da variante"""
+    for fmt, spec in OUTPUT_FORMATS.items():
+        if key.endswith(f".{spec['extension']}"):
+            return fmt
+    return DEFAULT_FORMAT
+
+def negotiate_format(accept, default: Optional[str] = None) -> Optional[str]:
+    """Escolhe o menor formato listado explicitamente no Accept (AVIF > WebP)
+    
+    Curingas como */* não contam: navegadores que suportam AVIF/WebP os
+    anunciam explicitamente.
+    """
+    explicit = {value for value, quality in accept if quality > 0}
+    for fmt in ('avif', 'webp'):
+        if OUTPUT_FORMATS[fmt]['mimetype'] in explicit and fmt in available_formats():
+            return fmt
+    return default
+
+def encode_to_bytes(image: Image.Image, fmt: str, options: dict) -> bytes:
+    """Codifica a imagem no formato de saída com as opções do encoder"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=OUTPUT_FORMATS[fmt]['pil_format'], **options)
+    return buffer.getvalue()
+
+class LRUByteCache:
+    """Cache LRU em memória limitado pelo total de bytes (thread-safe)"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Retorna o valor e o marca como usado recentemente"""
+        value, _ = self.get_with_ttl(key)
+        return value
+    
+    def get_with_ttl(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        """Retorna o valor e os segundos restantes até expirar (None = sem TTL)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            value, size, expires_at = entry
+            remaining = expires_at - time.monotonic() if expires_at is not None else None
+            if remaining is not None and remaining <= 0:
+                del self._entries[key]
+                self.current_bytes -= size
+                return None, None
+            self._entries.move_to_end(key)
+            return value, remaining
+    
+    def set(self, key: str, value: Any, size: int, ttl: Optional[float] = None) -> bool:
+        """Armazena o valor, removendo os menos usados até caber no limite"""
+        if size > self.max_bytes:
+            return False
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            return True
+    
+    def delete(self, key: str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+    
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self.current_bytes = 0
+            return count
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SourceEntry:
+    """Imagem de origem em cache, com os validadores HTTP da última resposta
+    
+    Guarda os bytes originais e as versões já decodificadas para cada
+    geometria de destino (chave de decodificação).
+    """
+    
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str]):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        # Hash do conteúdo: identifica o quadro independentemente da URL
+        self.digest = hashlib.md5(body).hexdigest()
+        self.fetched_at = time.monotonic()
+        # Substituído por inteiro a cada nova decodificação (nunca alterado no
+        # lugar): quem estiver iterando continua com a versão que leu
+        self.images = {}
+        self._lock = threading.Lock()
+    
+    def add_image(self, decode_key: Any, image: Image.Image):
+        """Memoriza uma decodificação (chamado por várias threads de download)"""
+        with self._lock:
+            self.images = {**self.images, decode_key: image}
+    
+    @property
+    def size(self) -> int:
+        """Bytes ocupados: corpo original mais os pixels decodificados"""
+        images = self.images
+        return len(self.body) + sum(
+            img.width * img.height * len(img.getbands()) for img in images.values()
+        )
+
+class SourceCache:
+    """Cache por URL de origem com revalidação condicional (ETag / Last-Modified)
+    
+    Dentro do TTL a imagem é servida sem nenhuma requisição. Após o TTL, a
+    entrada é revalidada com If-None-Match/If-Modified-Since; um 304 reaproveita
+    a imagem já decodificada, sem transferência nem decodificação.
+    """
+    
+    def __init__(self, ttl: int, max_bytes: int):
+        self.ttl = ttl
+        self.enabled = ttl > 0 and max_bytes > 0
+        self._cache = LRUByteCache(max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+    
+    def set_ttl(self, ttl: int):
+        """Altera o TTL (recarga de configuração); vale também para as entradas já guardadas"""
+        self.ttl = ttl
+        self.enabled = ttl > 0 and self._cache.max_bytes > 0
+    
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        CACHE_REQUESTS.labels('source', counter).inc()
+    
+    def get(self, url: str) -> Optional[SourceEntry]:
+        """Retorna a entrada da URL (fresca ou não), se existir"""
+        if not self.enabled:
+            return None
+        return self._cache.get(url)
+    
+    def is_fresh(self, entry: SourceEntry) -> bool:
+        return time.monotonic() - entry.fetched_at < self.ttl
+    
+    def conditional_headers(self, entry: Optional[SourceEntry]) -> dict:
+        """Cabeçalhos para revalidar a entrada junto ao servidor de origem"""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+    
+    def record_hit(self):
+        self._count('hits')
+    
+    def record_revalidated(self, entry: SourceEntry):
+        entry.fetched_at = time.monotonic()
+        self._count('revalidated')
+    
+    def store(self, url: str, entry: SourceEntry):
+        """Armazena (ou atualiza) a entrada; o tamanho considera os pixels em memória"""
+        if self.enabled:
+            self._cache.set(url, entry, entry.size)
+    
+    def record_miss(self):
+        self._count('misses')
+    
+    def clear(self) -> int:
+        return self._cache.clear()
+    
+    def get_stats(self) -> dict:
+        total = self.hits + self.revalidated + self.misses
+        return {
+            'enabled': self.enabled,
+            'ttl_seconds': self.ttl,
+            'entries': len(self._cache),
+            'bytes_used': self._cache.current_bytes,
+            'max_bytes': self._cache.max_bytes,
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.revalidated) / total, 3) if total else None
+        }
+
+class SourceTooLarge(Exception):
+    """Imagem de origem acima do limite de bytes ou de pixels"""
+
+class MemoryBudget:
+    """Orçamento de memória para decodificações simultâneas (por processo)
+    
+    Cada decodificação reserva a memória estimada da imagem decodificada e
+    espera enquanto o orçamento estiver esgotado. Uma imagem maior que o
+    orçamento inteiro é decodificada sozinha.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self.reservations = 0
+        self.waits = 0
+        self.timeouts = 0
+        self._cond = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, size: int, timeout: float):
+        size = min(size, self.max_bytes)
+        with self._cond:
+            if self.used + size > self.max_bytes:
+                self.waits += 1
+                if not self._cond.wait_for(lambda: self.used + size <= self.max_bytes, timeout):
+                    self.timeouts += 1
+                    raise Exception(f"orçamento de memória de decodificação esgotado ({self.max_bytes // (1024 * 1024)} MB)")
+            self.used += size
+            self.reservations += 1
+            self.peak = max(self.peak, self.used)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+    
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                'max_bytes': self.max_bytes,
+                'used_bytes': self.used,
+                'peak_bytes': self.peak,
+                'reservations': self.reservations,
+                'waits': self.waits,
+                'timeouts': self.timeouts
+            }
+
+class RequestMemory:
+    """Memória estimada de uma renderização: origens baixadas, decodificações
+    em andamento e imagem final, com o pico atingido"""
+    
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    def add(self, size: int):
+        with self._lock:
+            self.current += size
+            self.peak = max(self.peak, self.current)
+    
+    def release(self, size: int):
+        with self._lock:
+            self.current -= size
+
+# Memória da renderização em andamento; propagada para as threads de download
+# com contextvars.copy_context()
+_request_memory: contextvars.ContextVar[Optional[RequestMemory]] = contextvars.ContextVar('request_memory', default=None)
+
+@contextmanager
+def track_request_memory():
+    """Acompanha a memória estimada das renderizações feitas dentro do bloco"""
+    usage = RequestMemory()
+    token = _request_memory.set(usage)
+    try:
+        yield usage
+    finally:
+        _request_memory.reset(token)
+        if usage.peak:
+            REQUEST_PEAK_BYTES.observe(usage.peak)
+
+def _count_request_memory(size: int):
+    """Soma size à memória retida pela renderização atual, se acompanhada"""
+    usage = _request_memory.get()
+    if usage is not None:
+        usage.add(size)
+
+# Opções recarregáveis fixadas pela requisição em andamento (ver
+# ImageCombiner.settings); propagadas como _request_memory
+_request_settings: contextvars.ContextVar[Optional['Settings']] = contextvars.ContextVar('request_settings', default=None)
+
+@contextmanager
+def pin_settings(settings: 'Settings'):
+    """Faz ImageCombiner.settings retornar settings dentro do bloco, mesmo depois de uma recarga"""
+    token = _request_settings.set(settings)
+    try:
+        yield settings
+    finally:
+        _request_settings.reset(token)
+
+# Job da RenderQueue em execução: já foi aceito pela fila, então espera uma vaga
+# no pool de CPU em vez de ser recusado na hora como as requisições
+_background_render: contextvars.ContextVar[bool] = contextvars.ContextVar('background_render', default=False)
+
+def _run_in_background(fn):
+    _background_render.set(True)
+    return fn()
+
+class CacheCodec:
+    """Codifica as entradas do cache com um pequeno cabeçalho por entrada
+    
+    Formato: b'IC' + versão + id do codec + id do formato da imagem, seguido
+    do payload. Entradas antigas (gzip puro, sem cabeçalho) continuam legíveis.
+    "auto" não comprime formatos que já são comprimidos (JPEG, WebP, ...).
+    """
+    
+    MAGIC = b'IC'
+    VERSION = 1
+    GZIP_MAGIC = b'\x1f\x8b'
+    CODEC_IDS = {'none': 0, 'gzip': 1, 'zstd': 2, 'lz4': 3}
+    FORMAT_IDS = {'jpeg': 0, 'webp': 1, 'avif': 2, 'png': 3, 'raw': 4}
+    COMPRESSED_FORMATS = {'jpeg', 'webp', 'avif', 'png'}
+    
+    def __init__(self, name: str = 'auto'):
+        if (name == 'zstd' and zstandard is None) or (name == 'lz4' and lz4_frame is None):
+            logger.warning("⚠️ Codec %s não disponível, usando gzip", name)
+            name = 'gzip'
+        self.name = name
+        self._codec_names = {v: k for k, v in self.CODEC_IDS.items()}
+        self._format_names = {v: k for k, v in self.FORMAT_IDS.items()}
+        self._lock = threading.Lock()
+        self.format_stats = {}
+    
+    @staticmethod
+    def best_available() -> str:
+        if zstandard is not None:
+            return 'zstd'
+        if lz4_frame is not None:
+            return 'lz4'
+        return 'gzip'
+    
+    def codec_for(self, fmt: str) -> str:
+        if self.name != 'auto':
+            return self.name
+        return 'none' if fmt in self.COMPRESSED_FORMATS else self.best_available()
+    
+    def _record(self, fmt: str, codec: str, **values):
+        with self._lock:
+            stats = self.format_stats.setdefault(fmt, {
+                'codec': codec, 'entries': 0, 'original_bytes': 0, 'stored_bytes': 0,
+                'encode_cpu_seconds': 0.0, 'decodes': 0, 'decode_cpu_seconds': 0.0
+            })
+            stats['codec'] = codec
+            for name, value in values.items():
+                stats[name] += value
+    
+    def encode(self, data: bytes, fmt: str = 'jpeg') -> bytes:
+        codec = self.codec_for(fmt)
+        started = time.thread_time()
+        if codec == 'gzip':
+            payload = gzip.compress(data, compresslevel=6)
+        elif codec == 'zstd':
+            payload = zstandard.ZstdCompressor(level=3).compress(data)
+        elif codec == 'lz4':
+            payload = lz4_frame.compress(data)
+        else:
+            payload = data
+        header = self.MAGIC + bytes((self.VERSION, self.CODEC_IDS[codec], self.FORMAT_IDS.get(fmt, self.FORMAT_IDS['raw'])))
+        self._record(fmt, codec, entries=1, original_bytes=len(data), stored_bytes=len(payload),
+                     encode_cpu_seconds=time.thread_time() - started)
+        return header + payload
+    
+    def decode(self, blob: bytes) -> bytes:
+        if blob[:2] == self.GZIP_MAGIC:
+            # Entrada legada, gravada antes do cabeçalho existir
+            started = time.thread_time()
+            data = gzip.decompress(blob)
+            self._record('legacy', 'gzip', decodes=1, decode_cpu_seconds=time.thread_time() - started)
+            return data
+        if blob[:2] != self.MAGIC or len(blob) < 5:
+            raise ValueError("Entrada de cache com formato desconhecido")
+        
+        codec = self._codec_names[blob[3]]
+        fmt = self._format_names.get(blob[4], 'raw')
+        payload = memoryview(blob)[5:]
+        started = time.thread_time()
+        if codec == 'gzip':
+            data = gzip.decompress(payload)
+        elif codec == 'zstd':
+            data = zstandard.ZstdDecompressor().decompress(payload)
+        elif codec == 'lz4':
+            data = lz4_frame.decompress(payload)
+        else:
+            data = bytes(payload)
+        self._record(fmt, codec, decodes=1, decode_cpu_seconds=time.thread_time() - started)
+        return data
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            formats = {fmt: dict(values) for fmt, values in self.format_stats.items()}
+        for values in formats.values():
+            stored = values['stored_bytes']
+            values['compression_ratio'] = round(values['original_bytes'] / stored, 3) if stored else None
+            values['encode_cpu_seconds'] = round(values['encode_cpu_seconds'], 6)
+            values['decode_cpu_seconds'] = round(values['decode_cpu_seconds'], 6)
+        return {'codec': self.name, 'formats': formats}
+
+class SingleFlight:
+    """Agrupa chamadas simultâneas com a mesma chave em uma única execução
+    
+    A primeira chamada executa a função; as duplicadas que chegam enquanto ela
+    está em andamento aguardam e recebem o mesmo resultado (ou exceção).
+    """
+    
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+    
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class RenderQueueFull(Exception):
+    """A fila de renderização assíncrona está cheia"""
+
+class RenderJob:
+    """Renderização assíncrona de uma chave"""
+    
+    def __init__(self, key: str, fn):
+        self.key = key
+        self.fn = fn
+        # Roda com as opções fixadas por quem enfileirou (ver pin_settings)
+        self.context = contextvars.copy_context()
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+        # "queued" já publicado: só então a thread de renderização publica "rendering"
+        self.queued_published = threading.Event()
+    
+    def to_dict(self) -> dict:
+        return {
+            'key': self.key,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+class RenderQueue:
+    """Fila limitada de renderizações executadas por um pool de threads
+    
+    Pedidos para uma chave que já está na fila ou em renderização reutilizam
+    o mesmo job. Com a fila cheia, submit() levanta RenderQueueFull.
+    """
+    
+    MAX_FINISHED_JOBS = 256
+    
+    def __init__(self, workers: int, max_size: int, on_status=None):
+        self.workers = workers
+        self.max_size = max_size
+        self.on_status = on_status
+        self._queue = queue.Queue(maxsize=max_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'render-{i}', daemon=True).start()
+    
+    def _set_status(self, job: RenderJob, status: str):
+        job.status = status
+        if self.on_status is not None:
+            self.on_status(job)
+    
+    def submit(self, key: str, fn) -> RenderJob:
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status in ('queued', 'rendering'):
+                return job
+            # Só submit() coloca jobs na fila, sempre sob _lock: se não está cheia
+            # agora, o put_nowait abaixo não falha
+            if self._queue.full():
+                self.rejected += 1
+                raise RenderQueueFull(f"Fila de renderização cheia ({self.max_size} jobs)")
+            job = RenderJob(key, fn)
+            self._queue.put_nowait(job)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            self.submitted += 1
+            # Mantém apenas o histórico recente de jobs finalizados
+            while len(self._jobs) > self.max_size + self.MAX_FINISHED_JOBS:
+                oldest_key, oldest = next(iter(self._jobs.items()))
+                if oldest.status in ('queued', 'rendering'):
+                    break
+                del self._jobs[oldest_key]
+        
+        # Publica "queued" fora do _lock (pode esperar o Redis). A thread que
+        # pegar o job aguarda queued_published antes de publicar "rendering",
+        # então um "queued" atrasado nunca sobrescreve os status seguintes
+        try:
+            self._set_status(job, 'queued')
+        finally:
+            job.queued_published.set()
+        return job
+    
+    def get(self, key: str) -> Optional[RenderJob]:
+        with self._lock:
+            return self._jobs.get(key)
+    
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self.active += 1
+            job.queued_published.wait()
+            self._set_status(job, 'rendering')
+            try:
+                job.context.run(_run_in_background, job.fn)
+                job.finished_at = time.time()
+                with self._lock:
+                    self.completed += 1
+                self._set_status(job, 'done')
+            except Exception as e:
+                job.error = str(e)
+                job.finished_at = time.time()
+                with self._lock:
+                    self.failed += 1
+                logger.error("⚠️ Async render failed: %s...: %s", job.key[:16], e)
+                self._set_status(job, 'error')
+            finally:
+                with self._lock:
+                    self.active -= 1
+                job.done.set()
+                self._queue.task_done()
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue_max': self.max_size,
+                'active': self.active,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+class CpuPoolFull(Exception):
+    """O pool de CPU já tem o máximo de renderizações em andamento"""
+
+class _StageRecorder:
+    """Substitui STAGE_SECONDS nos processos do pool de CPU
+    
+    Acumula as durações de cada etapa para que o processo principal as
+    registre nas métricas dele.
+    """
+    
+    class _Stage:
+        def __init__(self, recorder: '_StageRecorder', stage: str):
+            self.recorder = recorder
+            self.stage = stage
+        
+        def observe(self, seconds: float):
+            self.recorder.timings.append((self.stage, seconds))
+        
+        @contextmanager
+        def time(self):
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - started)
+    
+    def __init__(self):
+        self.timings = []
+    
+    def labels(self, stage: str) -> '_StageRecorder._Stage':
+        return self._Stage(self, stage)
+
+def _cpu_worker_init():
+    """Inicialização de cada processo do pool de CPU"""
+    global STAGE_SECONDS
+    STAGE_SECONDS = _StageRecorder()
+
+def _cpu_task(fn, *args):
+    """Executa fn no processo do pool e devolve (resultado, durações das etapas)"""
+    STAGE_SECONDS.timings = []
+    return fn(*args), STAGE_SECONDS.timings
+
+# Tarefas executadas no pool de CPU. Imagens entram e saem como bytes
+# (comprimidos ou RGB crus), nunca como objetos PIL serializados.
+def _cpu_tile(body: bytes, cell_width: int, cell_height: int, resample: str, fit: str) -> Tuple[Tuple[int, int], bytes]:
+    """Decodifica e redimensiona uma origem; retorna o tamanho e os pixels RGB da célula"""
+    image = ImageCombiner.decode_image(body, (cell_width, cell_height), resample, fit)
+    with STAGE_SECONDS.labels('resize').time():
+        tile = ImageCombiner.resize_image_to_fit(image, cell_width, cell_height, resample, fit)
+    return tile.size, tile.tobytes()
+
+def _cpu_compose(tiles: List[Tuple[Tuple[int, int], bytes]], config: dict, options: dict) -> Tuple[bytes, float]:
+    """Cola as células (pixels RGB crus) na grade e codifica; retorna os bytes e o tempo de codificação"""
+    images = [Image.frombuffer('RGB', size, pixels, 'raw', 'RGB', 0, 1) for size, pixels in tiles]
+    combined_image = ImageCombiner.paste_tiles(images, config)
+    started = time.perf_counter()
+    image_data = encode_to_bytes(combined_image, config['format'], options)
+    return image_data, time.perf_counter() - started
+
+def _cpu_transcode(body: bytes, resample: str, fmt: str, options: dict) -> Tuple[bytes, float]:
+    """Decodifica a origem em tamanho original e codifica no formato de saída"""
+    image = ImageCombiner.decode_image(body, None, resample)
+    started = time.perf_counter()
+    image_data = encode_to_bytes(image, fmt, options)
+    return image_data, time.perf_counter() - started
+
+def _noop():
+    return None
+
+class CpuPool:
+    """Pool de processos para as etapas de CPU (decodificação, redimensionamento,
+    colagem e codificação), fora do GIL do processo que atende as requisições
+    
+    admit() limita as renderizações em andamento a max_pending; acima disso
+    levanta CpuPoolFull (o endpoint responde 503), ou antes espera até
+    timeout segundos por uma vaga, se informado. Os processos são criados
+    com spawn, pois o processo principal já tem threads em execução.
+    """
+    
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.tasks = 0
+        self.restarts = 0
+        # Todos os processos iniciados e respondendo (ver warm)
+        self.ready = threading.Event()
+        self.executor = self._create_executor()
+    
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_cpu_worker_init
+        )
+    
+    def warm(self):
+        """Inicia os processos antes da primeira renderização e espera todos responderem
+        
+        Chamado em uma thread de segundo plano: o spawn de cada processo
+        importa o app e não deve atrasar o início do atendimento.
+        """
+        wait([self.executor.submit(_noop) for _ in range(self.workers)])
+        self.ready.set()
+    
+    @contextmanager
+    def admit(self, timeout: Optional[float] = None):
+        """Reserva uma vaga de renderização; sem timeout, não espera"""
+        if timeout is None:
+            acquired = self._slots.acquire(blocking=False)
+        else:
+            acquired = self._slots.acquire(timeout=timeout)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            ERRORS.labels('cpu_pool').inc()
+            raise CpuPoolFull(f"Pool de CPU ocupado ({self.max_pending} renderizações em andamento)")
+        with self._lock:
+            self.active += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+    
+    def run(self, fn, *args):
+        """Executa fn(*args) em um processo do pool e registra as durações das etapas"""
+        executor = self.executor
+        with self._lock:
+            self.tasks += 1
+        try:
+            result, timings = executor.submit(_cpu_task, fn, *args).result()
+        except BrokenProcessPool:
+            # Um processo morreu (ex.: falta de memória): recria o pool para as próximas tarefas
+            with self._lock:
+                if self.executor is executor:
+                    self.executor = self._create_executor()
+                    self.restarts += 1
+                    logger.error("💥 CPU pool process died, pool restarted")
+            raise
+        for stage, seconds in timings:
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        return result
+    
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'active': self.active,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'tasks': self.tasks,
+                'restarts': self.restarts,
+                'ready': self.ready.is_set()
+            }
+
+class CachedImage:
+    """Imagem lida do cache com o TTL restante e a versão da gravação
+    
+    A versão é o instante de expiração registrado no índice quando a chave foi
+    gravada; muda a cada nova gravação da mesma chave.
+    """
+    
+    def __init__(self, data: Optional[bytes], ttl: float, version: Optional[float], path: Optional[str] = None):
+        self.data = data
+        self.ttl = ttl
+        self.version = version
+        # Arquivo do cache em disco com a imagem, quando servida de lá
+        self.path = path
+    
+    def etag(self, key: str) -> str:
+        """ETag forte derivado da chave e da versão da gravação"""
+        key_hash = key.split(':', 1)[-1]
+        if self.version is not None:
+            return f"{key_hash}-{round(self.version * 1000):x}"
+        return f"{key_hash}-{hashlib.md5(self.data).hexdigest()[:12]}"
+
+class DiskCache:
+    """Cache de imagens em arquivos, para instalações de um nó sem Redis
+    
+    Cada chave vira um arquivo nomeado pelo hash da chave (que já identifica
+    o conteúdo e a configuração), em subdiretórios de dois caracteres. O
+    mtime do arquivo guarda o instante de expiração (a versão da gravação) e
+    o atime o último acesso, usado no despejo LRU. As gravações são atômicas
+    (arquivo temporário + rename) e os arquivos guardam a imagem sem o codec
+    do cache, para serem servidos direto do disco.
+    """
+    
+    # Intervalo entre varreduras (expirados, arquivos temporários órfãos e LRU)
+    SWEEP_INTERVAL = 30
+    TMP_PREFIX = '.tmp-'
+    GENERATION_FILE = '.generation'
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = 0
+        self.entries = 0
+        self.evicted = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        # Pedido de varredura antecipada (gravação passou do limite)
+        self._sweep_requested = threading.Event()
+        # Primeira varredura concluída (contadores de bytes e entradas conhecidos)
+        self.scanned = threading.Event()
+    
+    def path_for(self, key: str) -> str:
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+    
+    def stat(self, key: str) -> Optional[Tuple[str, int, float]]:
+        """Caminho, tamanho e versão (expiração) da entrada, se ainda válida"""
+        path = self.path_for(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = st.st_mtime_ns / 1e9
+        if version <= time.time():
+            return None
+        return path, st.st_size, version
+    
+    def touch(self, path: str, version: float):
+        """Registra o acesso no atime, preservando a expiração no mtime"""
+        try:
+            os.utime(path, ns=(time.time_ns(), round(version * 1e9)))
+        except FileNotFoundError:
+            pass
+    
+    def read(self, path: str, version: float) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Despejado ou expirado entre o stat e a leitura
+            return None
+        self.touch(path, version)
+        return data
+    
+    def write(self, key: str, data: bytes, version: float):
+        """Grava a entrada atomicamente, expirando em version"""
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=self.TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.utime(tmp_path, ns=(time.time_ns(), round(version * 1e9)))
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = None
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        
+        with self._lock:
+            self.current_bytes += len(data) - (replaced or 0)
+            self.entries += replaced is None
+            over_limit = self.current_bytes > self.max_bytes
+        if over_limit:
+            # A varredura percorre o diretório inteiro: fica com a thread de
+            # sweep_loop, nunca com a requisição
+            self._sweep_requested.set()
+    
+    def read_generation(self) -> Optional[bytes]:
+        """Marca gravada por clear() em qualquer worker (fora dos subdiretórios varridos)"""
+        try:
+            with open(os.path.join(self.directory, self.GENERATION_FILE), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def bump_generation(self) -> bytes:
+        generation = str(time.time_ns()).encode()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=self.TMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(self.directory, self.GENERATION_FILE))
+        return generation
+    
+    def _scan(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir(follow_symlinks=False):
+                yield from os.scandir(shard.path)
+    
+    def sweep(self):
+        """Remove expirados e temporários órfãos e, acima do limite, os menos acessados
+        
+        O despejo vai até 90% do limite para não varrer a cada gravação.
+        Outros workers podem estar varrendo ao mesmo tempo: arquivos que
+        sumiram no meio do caminho são ignorados.
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            files, expired = [], 0
+            for item in self._scan():
+                try:
+                    st = item.stat(follow_symlinks=False)
+                    if item.name.startswith(self.TMP_PREFIX):
+                        if st.st_ctime < now - 60:
+                            os.unlink(item.path)
+                        continue
+                    if st.st_mtime <= now:
+                        os.unlink(item.path)
+                        expired += 1
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_atime, st.st_size, item.path))
+            
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            if total > self.max_bytes:
+                files.sort()
+                target = self.max_bytes * 0.9
+                while files and total > target:
+                    _, size, path = files.pop(0)
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    evicted += 1
+            
+            with self._lock:
+                self.current_bytes = total
+                self.entries = len(files)
+                self.expired += expired
+                self.evicted += evicted
+        finally:
+            self._sweep_lock.release()
+            self.scanned.set()
+    
+    def sweep_loop(self):
+        """Varre a cada SWEEP_INTERVAL segundos, ou antes se uma gravação passou do limite"""
+        while True:
+            self._sweep_requested.wait(self.SWEEP_INTERVAL)
+            self._sweep_requested.clear()
+            try:
+                self.sweep()
+            except OSError as e:
+                logger.warning("⚠️ Disk cache sweep error: %s", e)
+    
+    def clear(self) -> int:
+        deleted = 0
+        for item in self._scan():
+            try:
+                os.unlink(item.path)
+                deleted += 0 if item.name.startswith(self.TMP_PREFIX) else 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.current_bytes = 0
+            self.entries = 0
+        return deleted
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'entries': self.entries,
+                'bytes_used': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
+
+class CircuitBreaker:
+    """Disjuntor do Redis
+    
+    Depois de failure_threshold falhas de conexão seguidas o circuito abre: as
+    operações de cache falham rápido (como se o cache estivesse desabilitado)
+    e uma thread em segundo plano tenta reconectar a cada reset_timeout segundos.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.recoveries = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._opened = threading.Event()
+    
+    def allow(self) -> bool:
+        return self.state == self.CLOSED
+    
+    def record_success(self):
+        if self.failures:
+            with self._lock:
+                self.failures = 0
+    
+    def record_failure(self, error: Exception) -> bool:
+        """Registra uma falha; retorna True se o circuito abriu agora"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+                return True
+        return False
+    
+    def hold(self, reason: str):
+        """Mantém o circuito aberto sem contar uma queda (antes da primeira conexão)"""
+        with self._lock:
+            self.last_error = reason
+            self.state = self.OPEN
+            self._opened.set()
+    
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        self._opened.set()
+    
+    def close(self, recovered: bool = True):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            if recovered:
+                self.recoveries += 1
+            else:
+                self.last_error = None
+            self._opened.clear()
+    
+    def wait_until_open(self):
+        self._opened.wait()
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'opened_at': self.opened_at,
+                'trips': self.trips,
+                'recoveries': self.recoveries,
+                'last_error': self.last_error
+            }
+
 class RedisCache:
-    def __init__(self, host: str, port: int, password: str = None, ttl: int = 600, required: bool = True):
-        """Inicializa conexão com Redis"""
+    """Cache das imagens combinadas: L1 em memória, disco local e/ou Redis
+    
+    O backend (cache_backend) escolhe as camadas abaixo do L1: "redis", "disk"
+    (sem Redis, para instalações de um nó) ou "disk+redis" (disco na frente
+    do Redis; hits do Redis são copiados para o disco). Locks de renderização
+    e status de jobs entre workers dependem do Redis.
+    """
+    
+    BACKENDS = ('redis', 'disk', 'disk+redis')
+    
+    # Índice mantido a cada gravação, para não precisar de KEYS:
+    # - INDEX_KEY: sorted set chave -> instante de expiração
+    # - SIZES_KEY: hash chave -> bytes armazenados
+    # - BYTES_KEY: total de bytes das chaves ainda no índice
+    INDEX_KEY = "image_combiner:__index__"
+    SIZES_KEY = "image_combiner:__sizes__"
+    BYTES_KEY = "image_combiner:__bytes__"
+    STATS_SNAPSHOT_TTL = 30
+    # Chaves de combos são regravadas a cada renovação: no L1 ficam só por
+    # pouco tempo para que os outros workers vejam a nova versão
+    COMBO_PREFIX = "image_combiner:combo:"
+    COMBO_MEMORY_TTL = 1.0
+    SCAN_BATCH = 500
+    # Chaves image_combiner:__*__ são internas (índice, geração): não podem
+    # ser usadas como chave personalizada nem lidas como imagem
+    RESERVED_PREFIX = "image_combiner:__"
+    # Geração do cache, incrementada a cada clear(): cada worker a confere nas
+    # leituras (no máximo a cada GENERATION_CHECK_INTERVAL segundos) e
+    # descarta os seus caches em memória quando outro worker limpou o cache
+    GENERATION_KEY = "image_combiner:__generation__"
+    GENERATION_CHECK_INTERVAL = 1.0
+    
+    TRACK_SCRIPT = """
+    local old = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+    return redis.call('INCRBY', KEYS[3], tonumber(ARGV[3]) - old)
+    """
+    
+    PRUNE_SCRIPT = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    local freed = 0
+    for _, key in ipairs(expired) do
+        freed = freed + tonumber(redis.call('HGET', KEYS[2], key) or '0')
+        redis.call('HDEL', KEYS[2], key)
+        redis.call('ZREM', KEYS[1], key)
+    end
+    if freed > 0 then
+        redis.call('DECRBY', KEYS[3], freed)
+    end
+    return #expired
+    """
+    
+    def __init__(self, host: str, port: int, password: str = None, ttl: int = 600, required: bool = True,
+                 memory_cache_bytes: int = 0, codec: str = 'auto', enabled: bool = True,
+                 socket_timeout: float = 1.0, max_connections: int = 16, backend: str = 'redis',
+                 disk_dir: str = '/data/cache', disk_max_bytes: int = 0):
+        """Inicializa o cache em disco e/ou o pool de conexões com o Redis"""
         self.ttl = ttl
-        self.enabled = True
+        self.codec = CacheCodec(codec)
+        self.enabled = enabled
         self.required = required
+        self.backend = backend
+        self.breaker = CircuitBreaker()
+        self.redis_client = None
+        self.disk = None
+        
+        # Cache L1 em memória (já descomprimido) na frente do Redis
+        self.memory_cache = LRUByteCache(memory_cache_bytes) if memory_cache_bytes > 0 else None
+        self._stats_snapshot = None
+        self._stats_lock = threading.Lock()
+        self.tier_stats = {
+            'memory': {'hits': 0, 'misses': 0},
+            'disk': {'hits': 0, 'misses': 0},
+            'redis': {'hits': 0, 'misses': 0}
+        }
+        
+        # Invalidação do L1 entre workers (ver GENERATION_KEY); on_clear descarta
+        # também os outros caches em memória do processo
+        self.on_clear = None
+        self._generation = None
+        self._generation_checked = 0.0
         
+        # Primeira tentativa de conexão ao Redis concluída (com sucesso ou não)
+        self.connect_attempted = threading.Event()
+        self._connected_once = False
+        
+        if not self.enabled:
+            return
+        
+        if backend in ('disk', 'disk+redis'):
+            try:
+                self.disk = DiskCache(disk_dir, disk_max_bytes)
+            except OSError as e:
+                logger.error("❌ Disk cache unavailable at %s: %s", disk_dir, e)
+                raise SystemExit(f"FATAL: Cannot use disk cache directory {disk_dir}")
+            # As varreduras percorrem todo o diretório: rodam em segundo plano
+            threading.Thread(target=self._scan_disk, name='disk-cache-sweep', daemon=True).start()
+        if backend == 'disk':
+            return
+        
+        # Pool limitado: com todas as conexões em uso, a requisição espera no
+        # máximo socket_timeout por uma conexão livre
+        self.pool = redis.BlockingConnectionPool(
+            host=host,
+            port=port,
+            password=password if password else None,
+            max_connections=max_connections,
+            timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+            socket_timeout=socket_timeout
+        )
+        self.redis_client = redis.Redis(connection_pool=self.pool)
+        self._track_script = self.redis_client.register_script(self.TRACK_SCRIPT)
+        self._prune_script = self.redis_client.register_script(self.PRUNE_SCRIPT)
+        
+        # A conexão é feita em segundo plano: até ela, o circuito fica aberto e
+        # as requisições são atendidas sem a camada Redis
+        self.address = f"{host}:{port}"
+        self._pool_info = (max_connections, socket_timeout)
+        self.breaker.hold("connecting")
+        threading.Thread(target=self._reconnect_loop, name='redis-reconnect', daemon=True).start()
+    
+    @property
+    def available(self) -> bool:
+        """Cache habilitado e com alguma camada gravável (disco ou Redis com o circuito fechado)"""
+        return self.enabled and (self.disk is not None or self.redis_available)
+    
+    @property
+    def redis_available(self) -> bool:
+        """Redis configurado e com o circuito fechado"""
+        return self.redis_client is not None and self.breaker.allow()
+    
+    def _record_error(self, error: Exception):
+        """Conta falhas de conexão/timeout no disjuntor"""
+        # Pool esgotado não indica Redis doente, apenas carga
+        if isinstance(error, (RedisConnectionError, RedisTimeoutError)) and 'No connection available' not in str(error):
+            if self.breaker.record_failure(error):
+                logger.warning("🔌 Redis circuit OPEN after %d failures, cache bypassed until it recovers: %s",
+                               self.breaker.failures, error)
+    
+    def _scan_disk(self):
+        """Varredura inicial do cache em disco (expirados, órfãos e contadores) e as periódicas"""
         try:
-            self.redis_client = redis.Redis(
-                host=host,
-                port=port,
-                password=password if password else None,
-                decode_responses=False,  # Para trabalhar com dados binários
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
-            # Testa a conexão
-            self.redis_client.ping()
-            print(f"✅ Redis connected: {host}:{port}")
-        except (RedisConnectionError, Exception) as e:
-            if self.required:
-                print(f"❌ Redis connection FAILED: {e}")
-                print(f"🚫 Cache is required but Redis is not available at {host}:{port}")
-                print(f"💡 Please check:")
-                print(f"   - Redis server is running")
-                print(f"   - Host/port are correct: {host}:{port}")
-                print(f"   - Password is correct (if required)")
-                print(f"   - Network connectivity")
-                raise SystemExit(f"FATAL: Cannot connect to required Redis server at {host}:{port}")
+            self.disk.sweep()
+            logger.info("✅ Disk cache: %s (%d MB, %d entries)", self.disk.directory,
+                        self.disk.max_bytes // (1024 * 1024), self.disk.entries)
+        except OSError as e:
+            logger.warning("⚠️ Disk cache sweep error: %s", e)
+        self.disk.sweep_loop()
+    
+    def _reconnect_loop(self):
+        """Conecta ao Redis e, enquanto o circuito estiver aberto, testa a cada reset_timeout
+        
+        A primeira tentativa é imediata; as seguintes esperam reset_timeout.
+        """
+        delay = 0
+        while True:
+            self.breaker.wait_until_open()
+            time.sleep(delay)
+            delay = self.breaker.reset_timeout
+            try:
+                self.redis_client.ping()
+            except Exception as e:
+                self.breaker.last_error = str(e)
+                if not self.connect_attempted.is_set():
+                    self._log_connect_failure(e)
+                    self.connect_attempted.set()
+                continue
+            self.breaker.close(recovered=self._connected_once)
+            self._stats_snapshot = None
+            if self._connected_once:
+                logger.info("✅ Redis reconnected, circuit closed")
             else:
-                print(f"⚠️ Redis connection failed: {e}")
-                print("📝 Cache disabled - images will not be cached")
-                self.enabled = False
-                self.redis_client = None
+                logger.info("✅ Redis connected: %s (pool: %d connections, timeout: %.2fs)",
+                            self.address, *self._pool_info)
+            self._connected_once = True
+            self.connect_attempted.set()
+    
+    def _log_connect_failure(self, error: Exception):
+        if self.required:
+            logger.error("❌ Redis connection FAILED: %s", error)
+            logger.error("🚫 Cache is required but Redis is not available at %s: not ready until it connects "
+                         "(retrying every %ss)", self.address, self.breaker.reset_timeout)
+            logger.error("💡 Please check: Redis server is running, host/port are correct (%s), "
+                         "password is correct (if required), network connectivity", self.address)
+            return
+        logger.warning("⚠️ Redis connection failed: %s", error)
+        logger.warning("📝 Cache unavailable - retrying every %ss in background", self.breaker.reset_timeout)
+    
+    def readiness(self) -> dict:
+        """Estado das camadas do cache enquanto conectam/varrem em segundo plano
+        
+        Com redis_required, o serviço só fica pronto com o Redis conectado;
+        sem ele, basta a primeira tentativa de conexão ter terminado. O disco
+        já atende durante a varredura inicial e não segura a prontidão.
+        """
+        if not self.enabled:
+            return {'ready': True, 'disk': None, 'redis': None}
+        disk = None
+        if self.disk is not None:
+            disk = 'ready' if self.disk.scanned.is_set() else 'scanning'
+        redis_state = None
+        if self.redis_client is not None:
+            if self.breaker.allow():
+                redis_state = 'connected'
+            elif not self.connect_attempted.is_set():
+                redis_state = 'connecting'
+            else:
+                redis_state = 'unavailable'
+        ready = redis_state != 'connecting' and not (self.required and redis_state == 'unavailable')
+        return {'ready': ready, 'disk': disk, 'redis': redis_state}
     
     def _generate_key(self, urls: List[str], config: dict) -> str:
-        """Gera uma chave única baseada nas URLs e configurações"""
-        # Cria um hash das URLs e configurações
+        """Gera uma chave única baseada nas URLs e configurações
+        
+        O formato de saída não entra no hash: cada formato é uma variante
+        derivada da mesma chave base.
+        """
+        # Cria um hash das URLs (na ordem das células) e configurações
         data = {
-            'urls': sorted(urls),  # Ordena para consistência
-            'config': config
+            'urls': list(urls),
+            'config': {name: value for name, value in config.items() if name != 'format'}
         }
         data_str = json.dumps(data, sort_keys=True)
-        return f"image_combiner:{hashlib.md5(data_str.encode()).hexdigest()}"
+        base_key = f"image_combiner:{hashlib.md5(data_str.encode()).hexdigest()}"
+        return variant_key(base_key, config.get('format', DEFAULT_FORMAT))
+    
+    def _count(self, tier: str, outcome: str):
+        with self._stats_lock:
+            self.tier_stats[tier][outcome] += 1
+        CACHE_REQUESTS.labels(tier, outcome).inc()
+    
+    def _remember(self, key: str, image_data: bytes, ttl: float, version: Optional[float] = None):
+        """Guarda a imagem descomprimida no cache L1 pelo tempo restante no Redis"""
+        if key.startswith(self.COMBO_PREFIX):
+            ttl = min(ttl, self.COMBO_MEMORY_TTL)
+        if self.memory_cache is not None and ttl > 0:
+            self.memory_cache.set(key, (image_data, version), len(image_data), ttl)
+    
+    def _store(self, key: str, image_data: bytes, fmt: str, ttl: Optional[int] = None) -> float:
+        """Grava a imagem com TTL em cada camada (disco e/ou Redis)
+        
+        No Redis a entrada passa pelo codec e o índice é atualizado na mesma
+        ida ao servidor. A falha de uma camada só é registrada se a outra
+        gravou. Retorna a versão da gravação (instante de expiração).
+        """
+        ttl = ttl or self.ttl
+        version = time.time() + ttl
+        with STAGE_SECONDS.labels('cache_set').time():
+            disk_stored = False
+            if self.disk is not None:
+                try:
+                    self.disk.write(key, image_data, version)
+                    disk_stored = True
+                except OSError as e:
+                    if not self.redis_available:
+                        raise
+                    logger.warning("⚠️ Disk cache store error: %s", e)
+            if not self.redis_available:
+                return version
+            try:
+                data = self.codec.encode(image_data, fmt)
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(key, ttl, data)
+                self._track_script(
+                    keys=[self.INDEX_KEY, self.SIZES_KEY, self.BYTES_KEY],
+                    args=[key, version, len(data)],
+                    client=pipe
+                )
+                with REDIS_SECONDS.labels('set').time():
+                    pipe.execute()
+            except Exception as e:
+                if not disk_stored:
+                    raise
+                self._record_error(e)
+                logger.warning("⚠️ Redis tier store error: %s", e)
+                return version
+        self.breaker.record_success()
+        return version
+    
+    def _get_entry(self, key: str, with_data: bool = True, as_file: bool = False) -> Optional[CachedImage]:
+        """Busca a imagem no cache L1 e, se necessário, no disco e no Redis
+        
+        Com with_data=False consulta apenas TTL e versão, sem transferir a
+        imagem (usado para responder 304 sem ler o blob). Com as_file, um hit
+        do disco retorna só o caminho do arquivo, para ser enviado sem passar
+        pela memória do processo.
+        """
+        with STAGE_SECONDS.labels('cache_get').time():
+            return self._lookup(key, with_data, as_file)
+    
+    def _lookup(self, key: str, with_data: bool, as_file: bool = False) -> Optional[CachedImage]:
+        self._check_generation()
+        if self.memory_cache is not None:
+            value, remaining = self.memory_cache.get_with_ttl(key)
+            if value is not None:
+                self._count('memory', 'hits')
+                return CachedImage(value[0], remaining, value[1])
+            self._count('memory', 'misses')
+        
+        if self.disk is not None:
+            entry = self._lookup_disk(key, with_data, as_file)
+            if entry is not None:
+                return entry
+        
+        if not self.redis_available:
+            # Redis indisponível: falha rápido, como um miss
+            return None
+        
+        # GET, PTTL e versão em uma única ida ao Redis
+        pipe = self.redis_client.pipeline(transaction=False)
+        if with_data:
+            pipe.get(key)
+        pipe.pttl(key)
+        pipe.zscore(self.INDEX_KEY, key)
+        with REDIS_SECONDS.labels('get' if with_data else 'ttl').time():
+            results = pipe.execute()
+        self.breaker.record_success()
+        compressed_data = results.pop(0) if with_data else None
+        pttl, version = results
+        
+        if pttl is None or pttl == -2 or (with_data and not compressed_data):
+            self._count('redis', 'misses')
+            return None
+        
+        ttl = pttl / 1000 if pttl > 0 else 0
+        if not with_data:
+            return CachedImage(None, ttl, version)
+        
+        self._count('redis', 'hits')
+        # Descomprime os dados
+        image_data = self.codec.decode(compressed_data)
+        self._remember(key, image_data, ttl, version)
+        self._promote(key, image_data, version)
+        return CachedImage(image_data, ttl, version)
+    
+    def _lookup_disk(self, key: str, with_data: bool, as_file: bool) -> Optional[CachedImage]:
+        found = self.disk.stat(key)
+        image_data = None
+        if found is not None:
+            path, _, version = found
+            ttl = max(0.0, version - time.time())
+            if not with_data:
+                return CachedImage(None, ttl, version)
+            if as_file:
+                self._count('disk', 'hits')
+                self.disk.touch(path, version)
+                return CachedImage(None, ttl, version, path)
+            image_data = self.disk.read(path, version)
+        if image_data is None:
+            self._count('disk', 'misses')
+            return None
+        self._count('disk', 'hits')
+        self._remember(key, image_data, ttl, version)
+        return CachedImage(image_data, ttl, version, path)
+    
+    def _promote(self, key: str, image_data: bytes, version: Optional[float]):
+        """Copia para o disco uma imagem encontrada no Redis (disk+redis)"""
+        if self.disk is None or version is None or version <= time.time():
+            return
+        try:
+            self.disk.write(key, image_data, version)
+        except OSError as e:
+            logger.warning("⚠️ Disk cache store error: %s", e)
+    
+    def _get(self, key: str) -> Optional[bytes]:
+        entry = self._get_entry(key)
+        return entry.data if entry is not None else None
     
     def get_cached_image(self, urls: List[str], config: dict) -> Optional[bytes]:
         """Recupera imagem do cache"""
@@ -64,307 +1642,2231 @@ class RedisCache:
             
         try:
             key = self._generate_key(urls, config)
-            compressed_data = self.redis_client.get(key)
+            image_data = self._get(key)
             
-            if compressed_data:
-                # Descomprime os dados
-                image_data = gzip.decompress(compressed_data)
-                print(f"🎯 Cache HIT: {key[:16]}...")
+            if image_data:
+                access_logger.info("🎯 Cache HIT: %s...", key[:16])
                 return image_data
             else:
-                print(f"❌ Cache MISS: {key[:16]}...")
+                access_logger.info("❌ Cache MISS: %s...", key[:16])
                 return None
                 
         except Exception as e:
-            print(f"⚠️ Cache get error: {e}")
+            self._record_error(e)
+            logger.warning("⚠️ Cache get error: %s", e)
             return None
     
     def cache_image(self, urls: List[str], config: dict, image_data: bytes) -> Optional[str]:
         """Armazena imagem no cache com compressão e retorna a chave"""
-        if not self.enabled:
+        if not self.available:
             return None
             
         try:
             key = self._generate_key(urls, config)
+            fmt = config.get('format', DEFAULT_FORMAT)
             
-            # Comprime os dados da imagem
-            compressed_data = gzip.compress(image_data, compresslevel=6)
-            
-            # Armazena no Redis com TTL
-            self.redis_client.setex(key, self.ttl, compressed_data)
+            # Armazena com TTL (no Redis, codificado sem compressão para formatos já comprimidos)
+            version = self._store(key, image_data, fmt)
+            self._remember(key, image_data, self.ttl, version)
             
-            # Calcula estatísticas de compressão
-            original_size = len(image_data)
-            compressed_size = len(compressed_data)
-            compression_ratio = (1 - compressed_size / original_size) * 100
-            
-            print(f"💾 Cache STORED: {key[:16]}...")
-            print(f"📊 Compression: {original_size} → {compressed_size} bytes ({compression_ratio:.1f}% saved)")
+            access_logger.info(
+                "💾 Cache STORED: %s... (%s, %d bytes, codec %s)",
+                key[:16], self.backend, len(image_data), self.codec.codec_for(fmt)
+            )
             
             return key
             
         except Exception as e:
-            print(f"⚠️ Cache store error: {e}")
+            self._record_error(e)
+            logger.warning("⚠️ Cache store error: %s", e)
+            return None
+    
+    def peek(self, key: str) -> Optional[bytes]:
+        """Recupera a imagem sem registrar logs (usado ao aguardar outro worker)"""
+        if not self.enabled:
+            return None
+        try:
+            return self._get(key)
+        except Exception as e:
+            self._record_error(e)
             return None
     
+    def try_render_lock(self, key: str, ttl: float):
+        """Tenta marcar a chave como "em renderização" para todos os workers
+        
+        Retorna o lock adquirido, None se outro processo já está renderizando,
+        ou False se não for possível coordenar via Redis.
+        """
+        if not self.redis_available:
+            return False
+        try:
+            lock = self.redis_client.lock(f"{key}:rendering", timeout=ttl, blocking=False)
+            return lock if lock.acquire() else None
+        except Exception as e:
+            self._record_error(e)
+            logger.warning("⚠️ Render lock error: %s", e)
+            return False
+    
+    def is_rendering(self, key: str) -> bool:
+        """Indica se algum processo mantém o lock de renderização da chave"""
+        if not self.redis_available:
+            return False
+        try:
+            return bool(self.redis_client.exists(f"{key}:rendering"))
+        except Exception as e:
+            self._record_error(e)
+            return False
+    
+    def set_job_status(self, key: str, status: str, error: Optional[str] = None, ttl: int = 60):
+        """Publica o status do job assíncrono para todos os workers"""
+        if not self.redis_available:
+            return
+        try:
+            value = json.dumps({'status': status, 'error': error, 'updated_at': time.time()})
+            self.redis_client.setex(f"{key}:job", ttl, value)
+        except Exception as e:
+            self._record_error(e)
+            logger.warning("⚠️ Job status error: %s", e)
+    
+    def get_job_status(self, key: str) -> Optional[dict]:
+        if not self.redis_available:
+            return None
+        try:
+            value = self.redis_client.get(f"{key}:job")
+            return json.loads(value) if value else None
+        except Exception as e:
+            self._record_error(e)
+            return None
+    
+    def release_render_lock(self, lock):
+        try:
+            lock.release()
+        except Exception:
+            # O lock pode ter expirado; outro processo assume a partir daí
+            pass
+    
     def get_image_by_key(self, key: str) -> Optional[bytes]:
         """Recupera imagem do cache usando chave específica"""
+        entry = self.get_image_entry(key)
+        return entry.data if entry is not None else None
+    
+    def get_image_entry(self, key: str, with_data: bool = True, as_file: bool = False) -> Optional[CachedImage]:
+        """Recupera imagem, TTL restante e versão usando chave específica
+        
+        Com as_file, uma imagem no cache em disco vem só com o caminho (path).
+        """
         if not self.enabled:
             return None
             
         try:
-            compressed_data = self.redis_client.get(key)
+            entry = self._get_entry(key, with_data, as_file)
             
-            if compressed_data:
-                # Descomprime os dados
-                image_data = gzip.decompress(compressed_data)
-                print(f"🔑 Image retrieved by key: {key[:16]}...")
-                return image_data
+            if entry is not None:
+                if with_data:
+                    access_logger.info("🔑 Image retrieved by key: %s...", key[:16])
+                return entry
             else:
-                print(f"🔍 Key not found: {key[:16]}...")
+                access_logger.info("🔍 Key not found: %s...", key[:16])
                 return None
                 
         except Exception as e:
-            print(f"⚠️ Key retrieval error: {e}")
+            self._record_error(e)
+            logger.warning("⚠️ Key retrieval error: %s", e)
             return None
     
-    def store_image_with_custom_key(self, custom_key: str, image_data: bytes) -> bool:
-        """Armazena imagem com chave personalizada"""
-        if not self.enabled:
+    def store_image_with_custom_key(self, custom_key: str, image_data: bytes, fmt: str = 'jpeg',
+                                    ttl: Optional[int] = None) -> bool:
+        """Armazena imagem com chave personalizada (TTL padrão: cache_ttl)"""
+        if custom_key.startswith('__'):
+            raise ValueError("Chaves iniciadas por __ são reservadas")
+        if not self.available:
             return False
             
         try:
             full_key = f"image_combiner:{custom_key}"
             
-            # Comprime os dados da imagem
-            compressed_data = gzip.compress(image_data, compresslevel=6)
+            # Armazena com TTL em cada camada
+            version = self._store(full_key, image_data, fmt, ttl)
+            self._remember(full_key, image_data, ttl or self.ttl, version)
             
-            # Armazena no Redis com TTL
-            self.redis_client.setex(full_key, self.ttl, compressed_data)
-            
-            print(f"💾 Custom key stored: {custom_key}")
+            logger.info("💾 Custom key stored: %s", custom_key)
             
             return True
             
         except Exception as e:
-            print(f"⚠️ Custom key store error: {e}")
+            self._record_error(e)
+            logger.warning("⚠️ Custom key store error: %s", e)
             return False
     
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """Busca várias chaves: L1 primeiro e as restantes em uma única ida ao Redis
+        
+        Retorna apenas as chaves encontradas, já descomprimidas.
+        """
+        found = {}
+        if not self.enabled or not keys:
+            return found
+        
+        missing = []
+        self._check_generation()
+        for key in keys:
+            if self.memory_cache is not None:
+                value, _ = self.memory_cache.get_with_ttl(key)
+                if value is not None:
+                    self._count('memory', 'hits')
+                    found[key] = value[0]
+                    continue
+                self._count('memory', 'misses')
+            missing.append(key)
+        
+        if self.disk is not None:
+            for key in list(missing):
+                entry = self._lookup_disk(key, True, False)
+                if entry is not None:
+                    found[key] = entry.data
+                    missing.remove(key)
+        
+        if not missing or not self.redis_available:
+            return found
+        
+        try:
+            # MGET + PTTL e versão de cada chave no mesmo pipeline
+            with STAGE_SECONDS.labels('cache_get').time():
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.mget(missing)
+                for key in missing:
+                    pipe.pttl(key)
+                    pipe.zscore(self.INDEX_KEY, key)
+                with REDIS_SECONDS.labels('mget').time():
+                    results = pipe.execute()
+            self.breaker.record_success()
+        except Exception as e:
+            self._record_error(e)
+            logger.warning("⚠️ Cache mget error: %s", e)
+            return found
+        
+        blobs = results[0]
+        for i, (key, blob) in enumerate(zip(missing, blobs)):
+            pttl, version = results[1 + 2 * i], results[2 + 2 * i]
+            if not blob or pttl is None or pttl == -2:
+                self._count('redis', 'misses')
+                continue
+            self._count('redis', 'hits')
+            found[key] = self.codec.decode(blob)
+            self._remember(key, found[key], pttl / 1000 if pttl > 0 else 0, version)
+            self._promote(key, found[key], version)
+        return found
+    
+    def store_many(self, entries: List[Tuple[str, bytes, str]]) -> List[str]:
+        """Grava várias imagens (chave, bytes, formato) no disco e em uma única ida ao Redis
+        
+        Retorna as chaves gravadas (nenhuma se nenhuma camada estiver disponível).
+        """
+        if not entries or not self.available:
+            return []
+        
+        version = time.time() + self.ttl
+        disk_stored = False
+        if self.disk is not None:
+            try:
+                with STAGE_SECONDS.labels('cache_set').time():
+                    for key, image_data, _ in entries:
+                        self.disk.write(key, image_data, version)
+                disk_stored = True
+            except OSError as e:
+                logger.warning("⚠️ Disk cache batch store error: %s", e)
+                if not self.redis_available:
+                    return []
+        
+        if self.redis_available:
+            try:
+                with STAGE_SECONDS.labels('cache_set').time():
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    for key, image_data, fmt in entries:
+                        compressed_data = self.codec.encode(image_data, fmt)
+                        pipe.setex(key, self.ttl, compressed_data)
+                        self._track_script(
+                            keys=[self.INDEX_KEY, self.SIZES_KEY, self.BYTES_KEY],
+                            args=[key, version, len(compressed_data)],
+                            client=pipe
+                        )
+                    with REDIS_SECONDS.labels('mset').time():
+                        pipe.execute()
+                self.breaker.record_success()
+            except Exception as e:
+                self._record_error(e)
+                logger.warning("⚠️ Cache batch store error: %s", e)
+                if not disk_stored:
+                    return []
+        
+        for key, image_data, _ in entries:
+            self._remember(key, image_data, self.ttl, version)
+        access_logger.info("💾 Cache STORED batch: %d keys", len(entries))
+        return [key for key, _, _ in entries]
+    
+    def clear_memory(self) -> int:
+        """Esvazia o cache L1 e os demais caches em memória deste processo"""
+        if self.on_clear is not None:
+            self.on_clear()
+        return self.memory_cache.clear() if self.memory_cache is not None else 0
+    
+    def _read_generation(self) -> Optional[bytes]:
+        if self.redis_available:
+            return self.redis_client.get(self.GENERATION_KEY)
+        if self.disk is not None:
+            return self.disk.read_generation()
+        return None
+    
+    def _bump_generation(self) -> Optional[bytes]:
+        generation = None
+        if self.disk is not None:
+            generation = self.disk.bump_generation()
+        if self.redis_available:
+            generation = str(self.redis_client.incr(self.GENERATION_KEY)).encode()
+        return generation
+    
+    def _check_generation(self):
+        """Descarta os caches em memória se outro worker limpou o cache"""
+        now = time.monotonic()
+        if now - self._generation_checked < self.GENERATION_CHECK_INTERVAL:
+            return
+        self._generation_checked = now
+        try:
+            generation = self._read_generation()
+        except Exception as e:
+            self._record_error(e)
+            return
+        if generation is not None and generation != self._generation:
+            if self._generation is not None:
+                logger.info("🧹 Cache cleared by another worker, dropping in-memory caches")
+            self._generation = generation
+            self.clear_memory()
+    
+    def get_tier_stats(self) -> dict:
+        """Contadores de hit/miss por camada de cache"""
+        with self._stats_lock:
+            tiers = {tier: dict(counts) for tier, counts in self.tier_stats.items()}
+        memory = tiers['memory']
+        memory['enabled'] = self.memory_cache is not None
+        if self.memory_cache is not None:
+            memory['entries'] = len(self.memory_cache)
+            memory['bytes_used'] = self.memory_cache.current_bytes
+            memory['max_bytes'] = self.memory_cache.max_bytes
+        tiers['disk']['enabled'] = self.disk is not None
+        tiers['redis']['enabled'] = self.redis_client is not None
+        return tiers
+    
+    def _prune_index(self) -> int:
+        """Remove do índice as chaves já expiradas, em lotes"""
+        pruned = 0
+        while True:
+            count = self._prune_script(
+                keys=[self.INDEX_KEY, self.SIZES_KEY, self.BYTES_KEY],
+                args=[time.time(), self.SCAN_BATCH]
+            )
+            pruned += count
+            if count < self.SCAN_BATCH:
+                return pruned
+    
+    def _get_stats_snapshot(self) -> dict:
+        """Campos mais caros (INFO e limpeza do índice), recalculados a cada STATS_SNAPSHOT_TTL"""
+        snapshot = self._stats_snapshot
+        if snapshot is None or time.time() - snapshot['snapshot_at'] >= self.STATS_SNAPSHOT_TTL:
+            pruned = self._prune_index()
+            info = self.redis_client.info()
+            snapshot = {
+                "memory_used": info.get('used_memory_human', 'N/A'),
+                "connected_clients": info.get('connected_clients', 0),
+                "pruned_keys": pruned,
+                "snapshot_at": time.time()
+            }
+            self._stats_snapshot = snapshot
+        return snapshot
+    
     def get_cache_stats(self) -> dict:
         """Retorna estatísticas do cache"""
         if not self.enabled:
             return {"enabled": False, "message": "Redis not available"}
+        if self.redis_client is None:
+            # Somente disco: chaves e bytes contados na última varredura
+            disk = self.disk.get_stats()
+            return {
+                "enabled": True,
+                "available": True,
+                "backend": self.backend,
+                "total_keys": disk['entries'],
+                "total_bytes": disk['bytes_used'],
+                "ttl_seconds": self.ttl,
+                "tiers": self.get_tier_stats(),
+                "disk": disk
+            }
+        
+        stats = self._get_redis_stats()
+        stats["backend"] = self.backend
+        if self.disk is not None:
+            stats["disk"] = self.disk.get_stats()
+        return stats
+    
+    def _get_redis_stats(self) -> dict:
+        if not self.breaker.allow():
+            return {
+                "enabled": True,
+                "available": self.disk is not None,
+                "ttl_seconds": self.ttl,
+                "circuit": self.breaker.get_stats(),
+                "tiers": self.get_tier_stats(),
+                "codec": self.codec.get_stats()
+            }
             
         try:
-            info = self.redis_client.info()
-            keys = self.redis_client.keys("image_combiner:*")
+            snapshot = self._get_stats_snapshot()
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zcount(self.INDEX_KEY, time.time(), '+inf')
+            pipe.get(self.BYTES_KEY)
+            total_keys, total_bytes = pipe.execute()
             
             return {
                 "enabled": True,
-                "total_keys": len(keys),
-                "memory_used": info.get('used_memory_human', 'N/A'),
-                "connected_clients": info.get('connected_clients', 0),
-                "ttl_seconds": self.ttl
+                "available": True,
+                "total_keys": total_keys,
+                "total_bytes": int(total_bytes or 0),
+                "memory_used": snapshot['memory_used'],
+                "connected_clients": snapshot['connected_clients'],
+                "snapshot_at": snapshot['snapshot_at'],
+                "ttl_seconds": self.ttl,
+                "tiers": self.get_tier_stats(),
+                "codec": self.codec.get_stats(),
+                "circuit": self.breaker.get_stats(),
+                "pool_max_connections": self.pool.max_connections
             }
         except Exception as e:
-            return {"enabled": False, "error": str(e)}
+            self._record_error(e)
+            return {"enabled": True, "available": self.available, "error": str(e),
+                    "circuit": self.breaker.get_stats()}
+    
+    def clear(self) -> int:
+        """Remove todas as imagens do disco e, no Redis, com SCAN + UNLINK em lotes
+        
+        Locks de renderização em andamento são preservados. Retorna o número
+        de imagens removidas.
+        """
+        deleted = self.disk.clear() if self.disk is not None else 0
+        if self.redis_client is None:
+            self._finish_clear()
+            return deleted
+        batch = []
+        for key in self.redis_client.scan_iter(match="image_combiner:*", count=self.SCAN_BATCH):
+            if key.startswith(b"image_combiner:__") or key.endswith((b":rendering", b":job")):
+                continue
+            batch.append(key)
+            if len(batch) >= self.SCAN_BATCH:
+                deleted += self.redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.redis_client.unlink(*batch)
+        
+        self.redis_client.unlink(self.INDEX_KEY, self.SIZES_KEY, self.BYTES_KEY)
+        self._stats_snapshot = None
+        self._finish_clear()
+        return deleted
+    
+    def _finish_clear(self):
+        """Avisa os outros workers (nova geração) e esvazia os caches deste processo"""
+        self._generation = self._bump_generation()
+        self._generation_checked = time.monotonic()
+        self.clear_memory()
+
+COMBO_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+DEFAULT_COMBO_REFRESH = 60
+
+class Combo:
+    """Combinação nomeada declarada nas opções, renovada em segundo plano
+    
+    A imagem fica em uma chave estável (image_combiner:combo:<nome>) com TTL
+    bem maior que o intervalo de renovação: depois de refresh_interval ela
+    fica "velha", mas continua sendo servida enquanto uma renovação roda.
+    """
+    
+    def __init__(self, name: str, urls: List[str], config: dict, refresh_interval: int, cache_ttl: int):
+        self.name = name
+        self.urls = urls
+        self.config = config
+        self.refresh_interval = refresh_interval
+        self.ttl = max(cache_ttl, refresh_interval * 3)
+        self.custom_key = variant_key(f"combo:{name}", config['format'])
+        self.key = f"image_combiner:{self.custom_key}"
+        self.last_refresh = None
+        self.last_error = None
+    
+    def age(self, entry: CachedImage) -> Optional[float]:
+        """Segundos desde a última renderização, pela versão gravada no índice"""
+        if entry.version is None:
+            return None
+        return max(0.0, time.time() - (entry.version - self.ttl))
+    
+    def is_stale(self, entry: CachedImage, fraction: float = 1.0) -> bool:
+        age = self.age(entry)
+        return age is None or age >= self.refresh_interval * fraction
+    
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'urls_count': len(self.urls),
+            'key': self.custom_key,
+            'format': self.config['format'],
+            'refresh_interval': self.refresh_interval,
+            'ttl': self.ttl,
+            'last_refresh': self.last_refresh,
+            'last_error': self.last_error,
+            'image_url': f'/combo/{self.name}'
+        }
+
+class ComboScheduler:
+    """Enfileira a renovação de cada combo a cada refresh_interval
+    
+    Cada worker tem o seu agendador; a renovação em si confere a idade da
+    imagem e o lock de renderização no Redis, então só um worker renderiza.
+    """
+    
+    def __init__(self, combiner: 'ImageCombiner'):
+        self.combiner = combiner
+        self._next_run: Dict[str, float] = {}
+        self._thread = threading.Thread(target=self._run, name='combo-scheduler', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            try:
+                delay = self._tick()
+            except Exception as e:
+                # Uma falha não pode encerrar o agendador deste worker
+                logger.error("⚠️ Combo scheduler error: %s", e)
+                delay = 5
+            time.sleep(delay)
+    
+    def _tick(self) -> float:
+        """Enfileira os combos vencidos; retorna quanto esperar até o próximo"""
+        now = time.monotonic()
+        # Lê as opções a cada volta: uma recarga de configuração pode trocar os
+        # combos; as renovações enfileiradas seguem com as desta volta
+        settings = self.combiner.settings
+        combos = settings.combos
+        for name, combo in combos.items():
+            if now >= self._next_run.get(name, 0.0):
+                # Pequena variação para os workers não renovarem no mesmo instante
+                self._next_run[name] = now + combo.refresh_interval * random.uniform(0.85, 0.95)
+                try:
+                    with pin_settings(settings):
+                        self.combiner.schedule_combo_refresh(combo)
+                except Exception as e:
+                    logger.error("⚠️ Combo %s refresh scheduling failed: %s", name, e)
+        next_run = min((self._next_run[name] for name in combos), default=now + 5)
+        return max(0.5, next_run - time.monotonic())
+
+class StreamLimitReached(Exception):
+    """Limite de espectadores de /stream deste worker atingido"""
+
+class LiveStream:
+    """Loop de renderização de uma transmissão MJPEG, compartilhado pelos espectadores
+    
+    Uma thread renderiza no máximo `fps` quadros por segundo enquanto houver
+    espectadores e guarda só o quadro mais recente: quem lê devagar pula
+    quadros em vez de acumulá-los. Sem espectadores, o loop espera `linger`
+    segundos (uma reconexão reaproveita as células) e termina.
+    """
+    
+    def __init__(self, key: str, urls: List[str], config: dict, fps: float, render_frame, linger: float = 5.0):
+        self.key = key
+        self.urls = urls
+        self.config = config
+        self.fps = fps
+        self.linger = linger
+        # Última célula de cada origem: (hash do conteúdo, imagem)
+        self.tiles: List[Optional[Tuple[str, Image.Image]]] = [None] * len(urls)
+        self.frame: Optional[bytes] = None
+        self.seq = 0
+        self.viewers = 0
+        self.closed = False
+        self.frames_rendered = 0
+        self.frames_unchanged = 0
+        self.frames_dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._render_frame = render_frame
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='live-stream', daemon=True)
+    
+    def attach(self) -> bool:
+        """Registra um espectador; False se o loop já terminou"""
+        with self._cond:
+            if self.closed:
+                return False
+            self.viewers += 1
+            if not self._thread.is_alive():
+                self._thread.start()
+            return True
+    
+    def detach(self):
+        with self._cond:
+            self.viewers -= 1
+            self._cond.notify_all()
+    
+    def releaser(self):
+        """Função que libera o espectador registrado por attach uma única vez
+        
+        A resposta a chama no fim do gerador e ao ser fechada: um gerador que
+        nunca começou (cliente desconectou antes do primeiro quadro) nunca
+        executa o próprio finally.
+        """
+        released = []
+        
+        def release():
+            with self._cond:
+                if released:
+                    return
+                released.append(True)
+                self.detach()
+        return release
+    
+    def next_frame(self, last_seq: int, timeout: float) -> Tuple[Optional[bytes], int]:
+        """Espera um quadro mais novo que last_seq (até timeout) e retorna o mais recente"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != last_seq or self.closed, timeout)
+            if self.frame is not None and last_seq and self.seq - last_seq > 1:
+                self.frames_dropped += self.seq - last_seq - 1
+            return self.frame, self.seq
+    
+    def _run(self):
+        interval = 1.0 / self.fps
+        idle_since = None
+        while True:
+            with self._cond:
+                if self.viewers > 0:
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= self.linger:
+                    self.closed = True
+                    self._cond.notify_all()
+                    return
+            
+            started = time.monotonic()
+            try:
+                frame = self._render_frame(self)
+            except Exception as e:
+                frame = None
+                self.errors += 1
+                self.last_error = str(e)
+                logger.debug("Stream %s frame failed: %s", self.key, e)
+            
+            with self._cond:
+                if frame is None:
+                    self.frames_unchanged += 1
+                else:
+                    self.frame = frame
+                    self.seq += 1
+                    self.frames_rendered += 1
+                    self._cond.notify_all()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                'urls_count': len(self.urls),
+                'fps': self.fps,
+                'viewers': self.viewers,
+                'frames_rendered': self.frames_rendered,
+                'frames_unchanged': self.frames_unchanged,
+                'frames_dropped': self.frames_dropped,
+                'errors': self.errors,
+                'last_error': self.last_error
+            }
+
+class Settings:
+    """Opções recarregáveis em vigor, imutáveis depois de criadas
+    
+    Uma recarga monta um objeto novo e o publica em uma única atribuição
+    (ImageCombiner._settings); quem lê todas as opções do mesmo objeto nunca
+    vê uma mistura de valores antigos e novos.
+    """
+    
+    def __init__(self, **values):
+        self.__dict__.update(values)
+    
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f"Settings é imutável ({name})")
+    
+    def replace(self, **changes) -> 'Settings':
+        return Settings(**{**self.__dict__, **changes})
 
 class ImageCombiner:
+    # Tamanho dos blocos lidos ao baixar uma origem
+    READ_CHUNK_SIZE = 64 * 1024
+    
+    # Arquivo de opções do Home Assistant, observado para recarga a quente
+    OPTIONS_FILE = '/data/options.json'
+    CONFIG_POLL_INTERVAL = 5
+    
+    # Opções aplicadas sem reiniciar o processo: inteiros com (padrão, mínimo,
+    # máximo) e as validadas à parte em _read_settings. As demais dimensionam
+    # pools, conexões e o cache e só valem depois de reiniciar.
+    HOT_INT_OPTIONS = {
+        'max_images': (4, 1, MAX_TILES),
+        'image_quality': (85, 1, 100),
+        'cell_width': (400, 1, MAX_OUTPUT_SIZE),
+        'cell_height': (300, 1, MAX_OUTPUT_SIZE),
+        'timeout': (10, 1, None),
+        'source_cache_ttl': (10, 0, None),
+        'cache_ttl': (600, 1, None),
+        'long_poll_timeout': (10, 0, None),
+        'max_batch_size': (16, 1, None),
+        'stream_max_fps': (5, 1, None),
+        'max_stream_viewers': (2, 1, None),
+        'max_source_mb': (20, 1, None),
+        'max_source_megapixels': (50, 1, None),
+    }
+    HOT_OPTIONS = (*HOT_INT_OPTIONS, 'resample', 'output_format', 'jpeg_mode', 'log_level', 'log_sample_rate', 'combos')
+    
     def __init__(self):
         # Lê configurações do Home Assistant ou variáveis de ambiente
+        self._options_mtime = self._get_options_mtime()
         config = self.load_config()
+        self._config = config
+        self._boot_config = config
+        self.pending_restart: List[str] = []
+        self.last_reload = None
+        self._reload_lock = threading.Lock()
+        
+        # Opções recarregáveis (qualidade, células, limites, TTLs, logging);
+        # os combos entram depois que o cache existe
+        settings = self._read_settings(config)
+        self._publish_settings(settings)
+        logger.debug("📋 Configuration: %s", redact_config(config))
+        
+        self.download_workers = config.get('download_workers', 8)
+        source_cache_size_mb = config.get('source_cache_size_mb', 64)
+        tile_cache_mb = config.get('tile_cache_mb', 32)
+        
+        if not isinstance(self.download_workers, int) or self.download_workers <= 0:
+            self.download_workers = 8
+            logger.warning("⚠️ download_workers inválido, usando padrão: 8")
+        
+        # Custo de codificação por formato de saída
+        self._encode_lock = threading.Lock()
+        self.encode_stats = {}
+        
+        if not isinstance(source_cache_size_mb, int) or source_cache_size_mb < 0:
+            source_cache_size_mb = 64
+            logger.warning("⚠️ source_cache_size_mb inválido, usando padrão: 64")
         
-        # Get configuration from Home Assistant options or environment variables
-        self.max_images = config.get('max_images', 4)
-        self.image_quality = config.get('image_quality', 85)
-        self.cell_width = config.get('cell_width', 400)
-        self.cell_height = config.get('cell_height', 300)
-        self.timeout = config.get('timeout', 10)
+        # Cache das imagens de origem por URL (em memória, por processo)
+        self.source_cache = SourceCache(settings.source_cache_ttl, source_cache_size_mb * 1024 * 1024)
+        
+        if not isinstance(tile_cache_mb, int) or tile_cache_mb < 0:
+            tile_cache_mb = 32
+            logger.warning("⚠️ tile_cache_mb inválido, usando padrão: 32")
+        
+        # Células já redimensionadas, por hash do conteúdo da origem e geometria,
+        # e composições codificadas, por hash dos conteúdos na ordem das células
+        self.tile_cache = LRUByteCache(tile_cache_mb * 1024 * 1024) if tile_cache_mb > 0 else None
+        self._tile_lock = threading.Lock()
+        self.tile_stats = {
+            'tile': {'hits': 0, 'misses': 0},
+            'composite': {'hits': 0, 'misses': 0}
+        }
+        
+        # Sessão HTTP compartilhada: mantém conexões keep-alive por host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.download_workers, pool_maxsize=self.download_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # Pool limitado de downloads concorrentes, compartilhado entre requisições
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=self.download_workers,
+            thread_name_prefix='image-download'
+        )
+        
+        # Renderização assíncrona (opcional): /combine devolve a chave e enfileira o job
+        self.async_render = bool(config.get('async_render', False))
+        render_workers = config.get('render_workers', 2)
+        render_queue_size = config.get('render_queue_size', 16)
+        
+        if not isinstance(render_workers, int) or render_workers <= 0:
+            render_workers = 2
+            logger.warning("⚠️ render_workers inválido, usando padrão: 2")
+        
+        if not isinstance(render_queue_size, int) or render_queue_size <= 0:
+            render_queue_size = 16
+            logger.warning("⚠️ render_queue_size inválido, usando padrão: 16")
+        
+        self.render_queue = RenderQueue(render_workers, render_queue_size, on_status=self._publish_job_status)
+        
+        # Transmissões MJPEG (/stream): cada espectador ocupa uma thread do worker
+        self.streams: Dict[str, LiveStream] = {}
+        self._streams_lock = threading.Lock()
+        
+        # Orçamento de memória para decodificação (os limites das origens são recarregáveis)
+        decode_memory_mb = config.get('decode_memory_mb', 256)
+        
+        if not isinstance(decode_memory_mb, int) or decode_memory_mb < 0:
+            decode_memory_mb = 256
+            logger.warning("⚠️ decode_memory_mb inválido, usando padrão: 256")
+        
+        self.decode_budget = MemoryBudget(decode_memory_mb * 1024 * 1024) if decode_memory_mb > 0 else None
+        
+        # Pool de processos para decodificação, redimensionamento e codificação
+        cpu_pool = bool(config.get('cpu_pool', True))
+        cpu_workers = config.get('cpu_workers', 0)
+        cpu_queue_size = config.get('cpu_queue_size', 8)
+        
+        if not isinstance(cpu_workers, int) or cpu_workers < 0:
+            cpu_workers = 0
+            logger.warning("⚠️ cpu_workers inválido, usando padrão: 0 (automático)")
+        
+        if not isinstance(cpu_queue_size, int) or cpu_queue_size <= 0:
+            cpu_queue_size = 8
+            logger.warning("⚠️ cpu_queue_size inválido, usando padrão: 8")
+        
+        if cpu_workers == 0:
+            # Automático: núcleos disponíveis divididos entre os workers do gunicorn
+            cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+            cpu_workers = max(1, cores // max(1, int(os.getenv('WORKERS', 1))))
+        
+        self.cpu_pool = CpuPool(cpu_workers, cpu_queue_size) if cpu_pool else None
+        if self.cpu_pool is not None:
+            # Aquece em segundo plano: /ready indica quando os processos responderam
+            threading.Thread(target=self.cpu_pool.warm, name='cpu-pool-warm', daemon=True).start()
+            atexit.register(self.cpu_pool.shutdown)
+        
+        # Agrupa requisições idênticas em andamento neste processo
+        self.single_flight = SingleFlight()
+        self.coalesced_remote = 0
+        self._stats_lock = threading.Lock()
         
         # Redis configuration
         redis_host = config.get('redis_host', 'localhost')
         redis_port = config.get('redis_port', 6379)
         redis_password = config.get('redis_password', '')
-        cache_ttl = config.get('cache_ttl', 600)
+        cache_ttl = settings.cache_ttl
+        memory_cache_mb = config.get('memory_cache_mb', 32)
+        cache_codec = config.get('cache_codec', 'auto')
+        redis_timeout_ms = config.get('redis_timeout_ms', 1000)
+        redis_max_connections = config.get('redis_max_connections', 16)
         enable_cache = config.get('enable_cache', True)
         redis_required = config.get('redis_required', True)
+        cache_backend = config.get('cache_backend', 'redis')
+        disk_cache_dir = config.get('disk_cache_dir', '/data/cache')
+        disk_cache_mb = config.get('disk_cache_mb', 1024)
         
         # Validação e correção de tipos
+        if cache_backend not in RedisCache.BACKENDS:
+            cache_backend = 'redis'
+            logger.warning("⚠️ cache_backend inválido, usando padrão: redis")
+        
+        if not disk_cache_dir or not isinstance(disk_cache_dir, str):
+            disk_cache_dir = '/data/cache'
+            logger.warning("⚠️ disk_cache_dir vazio, usando padrão: /data/cache")
+        
+        if not isinstance(disk_cache_mb, int) or disk_cache_mb <= 0:
+            disk_cache_mb = 1024
+            logger.warning("⚠️ disk_cache_mb inválido, usando padrão: 1024")
+        
         if not redis_host or redis_host == '':
             redis_host = 'localhost'
-            print(f"⚠️ redis_host vazio, usando padrão: localhost")
+            logger.warning("⚠️ redis_host vazio, usando padrão: localhost")
         
         if not isinstance(redis_port, int) or redis_port <= 0:
             redis_port = 6379
-            print(f"⚠️ redis_port inválido, usando padrão: 6379")
+            logger.warning("⚠️ redis_port inválido, usando padrão: 6379")
         
-        if not isinstance(cache_ttl, int) or cache_ttl <= 0:
-            cache_ttl = 600
-            print(f"⚠️ cache_ttl inválido, usando padrão: 600")
+        if not isinstance(memory_cache_mb, int) or memory_cache_mb < 0:
+            memory_cache_mb = 32
+            logger.warning("⚠️ memory_cache_mb inválido, usando padrão: 32")
+        
+        if cache_codec not in ('auto', *CacheCodec.CODEC_IDS):
+            cache_codec = 'auto'
+            logger.warning("⚠️ cache_codec inválido, usando padrão: auto")
+        
+        if not isinstance(redis_timeout_ms, int) or redis_timeout_ms <= 0:
+            redis_timeout_ms = 1000
+            logger.warning("⚠️ redis_timeout_ms inválido, usando padrão: 1000")
+        
+        if not isinstance(redis_max_connections, int) or redis_max_connections <= 0:
+            redis_max_connections = 16
+            logger.warning("⚠️ redis_max_connections inválido, usando padrão: 16")
         
         # Log da configuração Redis para debug
-        print(f"🔧 Redis Configuration:")
-        print(f"   - Host: '{redis_host}' (type: {type(redis_host).__name__})")
-        print(f"   - Port: {redis_port} (type: {type(redis_port).__name__})")
-        print(f"   - Password: {'***' if redis_password else '(none)'}")
-        print(f"   - Cache enabled: {enable_cache}")
-        print(f"   - Redis required: {redis_required}")
-        print(f"   - TTL: {cache_ttl}s")
+        logger.debug(
+            "🔧 Redis Configuration: backend=%s host=%r port=%s password=%s enabled=%s required=%s ttl=%ss "
+            "memory_cache=%sMB codec=%s timeout=%sms max_connections=%s",
+            cache_backend, redis_host, redis_port, '***' if redis_password else '(none)', enable_cache,
+            redis_required, cache_ttl, memory_cache_mb, cache_codec, redis_timeout_ms, redis_max_connections
+        )
+        
+        # Initialize Redis cache
+        if enable_cache:
+            # Redis é obrigatório ou opcional baseado na configuração
+            self.cache = RedisCache(redis_host, redis_port, redis_password, cache_ttl, required=redis_required,
+                                    memory_cache_bytes=memory_cache_mb * 1024 * 1024, codec=cache_codec,
+                                    socket_timeout=redis_timeout_ms / 1000,
+                                    max_connections=redis_max_connections, backend=cache_backend,
+                                    disk_dir=disk_cache_dir, disk_max_bytes=disk_cache_mb * 1024 * 1024)
+        else:
+            logger.info("📝 Cache disabled by configuration")
+            # Quando cache está desabilitado, Redis não é obrigatório
+            self.cache = RedisCache("", 0, required=False, enabled=False)
+        
+        self.cache.on_clear = self._clear_memory_caches
+        
+        # Combos nomeados renovados em segundo plano
+        settings = settings.replace(combos=self._load_combos(config.get('combos', []), cache_ttl))
+        self._publish_settings(settings)
+        self.combo_scheduler = None
+        self._start_combo_scheduler(settings)
+        
+        # Recarga a quente quando o arquivo de opções muda
+        threading.Thread(target=self._watch_config, name='config-watch', daemon=True).start()
+    
+    def _clear_memory_caches(self):
+        """Descarta as imagens de origem e células mantidas em memória neste processo"""
+        self.source_cache.clear()
+        if self.tile_cache is not None:
+            self.tile_cache.clear()
+    
+    def _start_combo_scheduler(self, settings: Settings):
+        """Inicia o agendador se as opções publicadas têm combos
+        
+        Recebe as opções recém-publicadas: numa recarga feita por requisição,
+        self.settings ainda é o objeto fixado antes dela.
+        """
+        if settings.combos and self.cache.enabled and self.combo_scheduler is None:
+            self.combo_scheduler = ComboScheduler(self)
+            self.combo_scheduler.start()
+    
+    def _read_settings(self, config: dict) -> Settings:
+        """Valida as opções recarregáveis; valores inválidos voltam ao padrão com aviso
+        
+        Os combos ficam vazios: são montados com o objeto retornado (ver reload_config).
+        """
+        settings = {}
+        for name, (default, minimum, maximum) in self.HOT_INT_OPTIONS.items():
+            value = config.get(name, default)
+            if (not isinstance(value, int) or isinstance(value, bool) or value < minimum
+                    or (maximum is not None and value > maximum)):
+                logger.warning("⚠️ %s inválido, usando padrão: %s", name, default)
+                value = default
+            settings[name] = value
+        
+        settings['resample'] = config.get('resample', DEFAULT_RESAMPLE)
+        if settings['resample'] not in RESAMPLE_TIERS:
+            settings['resample'] = DEFAULT_RESAMPLE
+            logger.warning("⚠️ resample inválido, usando padrão: %s", DEFAULT_RESAMPLE)
+        
+        settings['output_format'] = config.get('output_format', DEFAULT_FORMAT)
+        if settings['output_format'] not in available_formats():
+            logger.warning("⚠️ output_format %s não suportado, usando padrão: %s",
+                           settings['output_format'], DEFAULT_FORMAT)
+            settings['output_format'] = DEFAULT_FORMAT
+        
+        settings['jpeg_mode'] = config.get('jpeg_mode', 'optimized')
+        if settings['jpeg_mode'] not in JPEG_MODES:
+            settings['jpeg_mode'] = 'optimized'
+            logger.warning("⚠️ jpeg_mode inválido, usando padrão: optimized")
+        
+        settings['log_level'] = config.get('log_level', 'info')
+        if settings['log_level'] not in LOG_LEVELS:
+            settings['log_level'] = 'info'
+        
+        settings['log_sample_rate'] = config.get('log_sample_rate', 0.01)
+        if not isinstance(settings['log_sample_rate'], (int, float)) or not 0 <= settings['log_sample_rate'] <= 1:
+            settings['log_sample_rate'] = 0.01
+        
+        settings['max_source_bytes'] = settings['max_source_mb'] * 1024 * 1024
+        settings['max_source_pixels'] = settings['max_source_megapixels'] * 1_000_000
+        return Settings(**settings, combos={})
+    
+    @property
+    def settings(self) -> Settings:
+        """Opções fixadas pela requisição em andamento ou, fora dela, as em vigor
+        
+        Cada requisição fixa o objeto em vigor ao começar (pin_request_settings)
+        e segue com ele até o fim, assim como as threads de download e os jobs
+        assíncronos que ela criar, mesmo que uma recarga aconteça no meio.
+        """
+        return _request_settings.get() or self._settings
+    
+    def _publish_settings(self, settings: Settings):
+        """Troca as opções recarregáveis em uma única atribuição"""
+        self._settings = settings
+        setup_logging(settings.log_level, settings.log_sample_rate)
+    
+    def reload_config(self) -> dict:
+        """Relê as opções e aplica as recarregáveis sem reiniciar o processo
+        
+        Qualidade, células, formato e modo JPEG fazem parte da chave do cache:
+        as próximas imagens usam chaves novas e as antigas expiram pelo TTL,
+        sem limpar o cache. TTLs novos valem para as próximas gravações. As
+        demais opções alteradas são listadas em pending_restart.
+        
+        Vale só para este processo: os demais workers aplicam a mesma mudança
+        ao notar o novo mtime do arquivo de opções (_watch_config).
+        """
+        config = self.load_config(strict=True)
+        with self._reload_lock:
+            changed = sorted(name for name in set(config) | set(self._config)
+                             if config.get(name) != self._config.get(name))
+            applied = [name for name in changed if name in self.HOT_OPTIONS]
+            restart = [name for name in changed if name not in self.HOT_OPTIONS]
+            self._config = config
+            self.pending_restart = sorted(
+                name for name in set(config) | set(self._boot_config)
+                if name not in self.HOT_OPTIONS and config.get(name) != self._boot_config.get(name)
+            )
+            
+            if applied:
+                settings = self._read_settings(config)
+                # Combos guardam a configuração efetiva: são refeitos com as novas
+                # opções antes de elas serem publicadas, junto com eles
+                with pin_settings(settings):
+                    combos = self._load_combos(config.get('combos', []), settings.cache_ttl)
+                settings = settings.replace(combos=combos)
+                self._publish_settings(settings)
+                # Os TTLs do cache de origem e das imagens só afetam a expiração
+                # das próximas gravações, não o conteúdo nem a chave delas
+                self.source_cache.set_ttl(settings.source_cache_ttl)
+                self.cache.ttl = settings.cache_ttl
+                self._start_combo_scheduler(settings)
+                logger.info("🔄 Configuration reloaded: %s", ', '.join(applied))
+            if restart:
+                logger.warning("⚠️ Options changed that only apply after a restart: %s", ', '.join(restart))
+            if changed:
+                self.last_reload = {'at': time.time(), 'applied': applied, 'restart_required': restart}
+        return {'applied': applied, 'restart_required': restart, 'pending_restart': self.pending_restart}
+    
+    @classmethod
+    def _get_options_mtime(cls) -> Optional[int]:
+        try:
+            return os.stat(cls.OPTIONS_FILE).st_mtime_ns
+        except OSError:
+            return None
+    
+    def _watch_config(self):
+        """Recarrega as opções quando o arquivo de opções muda (mtime a cada CONFIG_POLL_INTERVAL)"""
+        failed_mtime = None
+        while True:
+            time.sleep(self.CONFIG_POLL_INTERVAL)
+            mtime = self._get_options_mtime()
+            if mtime is None or mtime == self._options_mtime:
+                continue
+            try:
+                self.reload_config()
+            except Exception as e:
+                # Arquivo no meio de uma gravação: tenta de novo na próxima volta
+                if mtime != failed_mtime:
+                    logger.warning("⚠️ Config reload failed, keeping current settings: %s", e)
+                    failed_mtime = mtime
+                continue
+            self._options_mtime = mtime
+    
+    def readiness(self) -> dict:
+        """Prontidão do processo: backends conectados e pool de CPU aquecido
         
-        # Initialize Redis cache
-        if enable_cache:
-            # Redis é obrigatório ou opcional baseado na configuração
-            self.cache = RedisCache(redis_host, redis_port, redis_password, cache_ttl, required=redis_required)
-        else:
-            print("📝 Cache disabled by configuration")
-            # Quando cache está desabilitado, Redis não é obrigatório
-            self.cache = RedisCache("", 0, required=False)
-            self.cache.enabled = False
+        O serviço atende desde o início; até ficar pronto, as requisições
+        funcionam sem as camadas ainda indisponíveis (ex.: sem o Redis).
+        """
+        cache = self.cache.readiness()
+        cpu_pool = None
+        if self.cpu_pool is not None:
+            cpu_pool = 'ready' if self.cpu_pool.ready.is_set() else 'warming'
+        return {
+            'ready': cache['ready'] and cpu_pool != 'warming',
+            'cache': cache,
+            'cpu_pool': cpu_pool
+        }
+    
+    def _load_combos(self, entries: Any, cache_ttl: int) -> dict:
+        """Valida os combos das opções; entradas inválidas são ignoradas com aviso"""
+        combos = {}
+        if not isinstance(entries, list):
+            logger.warning("⚠️ combos inválido, ignorando")
+            return combos
+        for entry in entries:
+            name = entry.get('name') if isinstance(entry, dict) else None
+            try:
+                if not isinstance(name, str) or not COMBO_NAME_PATTERN.match(name):
+                    raise ValueError("nome deve conter apenas letras, números, - e _")
+                if name in combos:
+                    raise ValueError("nome duplicado")
+                urls = entry.get('urls')
+                if not isinstance(urls, list) or not all(isinstance(url, str) and url.startswith(('http://', 'https://')) for url in urls):
+                    raise ValueError("urls deve ser uma lista de URLs http(s)")
+                refresh_interval = entry.get('refresh_interval', DEFAULT_COMBO_REFRESH)
+                if not isinstance(refresh_interval, int) or refresh_interval < 5:
+                    raise ValueError("refresh_interval deve ser um inteiro >= 5")
+                layout = {field: entry[field] for field in ('cols', 'rows', 'width', 'height', 'fit') if field in entry}
+                config = self._build_config(urls, entry.get('resample'), entry.get('format'), layout)
+            except ValueError as e:
+                logger.warning("⚠️ Combo %r inválido, ignorando: %s", name, e)
+                continue
+            combos[name] = Combo(name, urls, config, refresh_interval, cache_ttl)
+        if combos:
+            logger.info("🗂️ Combos: %s", ', '.join(f"{c.name} ({c.refresh_interval}s)" for c in combos.values()))
+        return combos
     
-    def load_config(self) -> dict:
-        """Carrega configuração do Home Assistant ou variáveis de ambiente"""
-        import json
+    def load_config(self, strict: bool = False) -> dict:
+        """Carrega configuração do Home Assistant ou variáveis de ambiente
         
+        Com strict, um arquivo de opções ilegível levanta a exceção em vez de
+        cair nas variáveis de ambiente (usado na recarga a quente).
+        """
         # Tenta ler do arquivo de opções do Home Assistant
-        options_file = '/data/options.json'
+        options_file = self.OPTIONS_FILE
         
         if os.path.exists(options_file):
             try:
                 with open(options_file, 'r') as f:
                     config = json.load(f)
-                print(f"📋 Configuration loaded from Home Assistant options")
-                print(f"🔍 Raw config: {config}")
                 return config
             except Exception as e:
-                print(f"⚠️ Error reading options file: {e}")
+                if strict:
+                    raise
+                logger.warning("⚠️ Error reading options file: %s", e)
         
         # Fallback para variáveis de ambiente (para desenvolvimento)
-        print(f"📋 Configuration loaded from environment variables")
         env_config = {
             'max_images': int(os.getenv('MAX_IMAGES', 4)),
             'image_quality': int(os.getenv('IMAGE_QUALITY', 85)),
             'cell_width': int(os.getenv('CELL_WIDTH', 400)),
             'cell_height': int(os.getenv('CELL_HEIGHT', 300)),
             'timeout': int(os.getenv('TIMEOUT', 10)),
+            'download_workers': int(os.getenv('DOWNLOAD_WORKERS', 8)),
+            'resample': os.getenv('RESAMPLE', DEFAULT_RESAMPLE),
+            'output_format': os.getenv('OUTPUT_FORMAT', DEFAULT_FORMAT),
+            'jpeg_mode': os.getenv('JPEG_MODE', 'optimized'),
+            'source_cache_ttl': int(os.getenv('SOURCE_CACHE_TTL', 10)),
+            'source_cache_size_mb': int(os.getenv('SOURCE_CACHE_SIZE_MB', 64)),
+            'tile_cache_mb': int(os.getenv('TILE_CACHE_MB', 32)),
             'redis_host': os.getenv('REDIS_HOST', 'localhost'),
             'redis_port': int(os.getenv('REDIS_PORT', 6379)),
             'redis_password': os.getenv('REDIS_PASSWORD', ''),
             'cache_ttl': int(os.getenv('CACHE_TTL', 600)),
+            'memory_cache_mb': int(os.getenv('MEMORY_CACHE_MB', 32)),
+            'async_render': os.getenv('ASYNC_RENDER', 'false').lower() == 'true',
+            'render_workers': int(os.getenv('RENDER_WORKERS', 2)),
+            'render_queue_size': int(os.getenv('RENDER_QUEUE_SIZE', 16)),
+            'long_poll_timeout': int(os.getenv('LONG_POLL_TIMEOUT', 10)),
+            'max_batch_size': int(os.getenv('MAX_BATCH_SIZE', 16)),
+            'stream_max_fps': int(os.getenv('STREAM_MAX_FPS', 5)),
+            'max_stream_viewers': int(os.getenv('MAX_STREAM_VIEWERS', 2)),
+            'max_source_mb': int(os.getenv('MAX_SOURCE_MB', 20)),
+            'max_source_megapixels': int(os.getenv('MAX_SOURCE_MEGAPIXELS', 50)),
+            'decode_memory_mb': int(os.getenv('DECODE_MEMORY_MB', 256)),
+            'cpu_pool': os.getenv('CPU_POOL', 'true').lower() == 'true',
+            'cpu_workers': int(os.getenv('CPU_WORKERS', 0)),
+            'cpu_queue_size': int(os.getenv('CPU_QUEUE_SIZE', 8)),
+            'cache_codec': os.getenv('CACHE_CODEC', 'auto'),
+            'redis_timeout_ms': int(os.getenv('REDIS_TIMEOUT_MS', 1000)),
+            'redis_max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 16)),
+            'cache_backend': os.getenv('CACHE_BACKEND', 'redis'),
+            'disk_cache_dir': os.getenv('DISK_CACHE_DIR', '/data/cache'),
+            'disk_cache_mb': int(os.getenv('DISK_CACHE_MB', 1024)),
+            'log_level': os.getenv('LOG_LEVEL', 'info'),
+            'log_sample_rate': float(os.getenv('LOG_SAMPLE_RATE', 0.01)),
             'enable_cache': os.getenv('ENABLE_CACHE', 'true').lower() == 'true',
-            'redis_required': os.getenv('REDIS_REQUIRED', 'true').lower() == 'true'
+            'redis_required': os.getenv('REDIS_REQUIRED', 'true').lower() == 'true',
+            'combos': json.loads(os.getenv('COMBOS', '[]'))
         }
-        print(f"🔍 Env config: {env_config}")
         return env_config
     
-    def get_config_dict(self) -> dict:
+    def get_config_dict(self, resample: Optional[str] = None, fmt: Optional[str] = None) -> dict:
         """Retorna configuração atual como dicionário para cache key"""
+        settings = self.settings
         return {
-            'image_quality': self.image_quality,
-            'cell_width': self.cell_width,
-            'cell_height': self.cell_height,
-            'max_images': self.max_images
+            'image_quality': settings.image_quality,
+            'cell_width': settings.cell_width,
+            'cell_height': settings.cell_height,
+            'max_images': settings.max_images,
+            'resample': resample or settings.resample,
+            'jpeg_mode': settings.jpeg_mode,
+            'format': fmt or settings.output_format
         }
     
-    def download_image(self, url: str) -> Image.Image:
-        """Baixa uma imagem de uma URL e retorna um objeto PIL Image"""
+    def fetch_source(self, url: str, revalidate: bool = False) -> SourceEntry:
+        """Obtém os bytes de uma URL de origem, usando o cache de origem
+        
+        Dentro do TTL não faz requisição (a menos que revalidate seja True);
+        depois dele revalida com os validadores salvos e reaproveita a entrada
+        em caso de 304.
+        """
+        entry = self.source_cache.get(url)
+        if entry is not None and not revalidate and self.source_cache.is_fresh(entry):
+            self.source_cache.record_hit()
+            return entry
+        
+        headers = self.source_cache.conditional_headers(entry)
+        with DOWNLOAD_SECONDS.labels(host_label(url)).time():
+            with self.session.get(url, timeout=self.settings.timeout, headers=headers, stream=True) as response:
+                if response.status_code == 304 and entry is not None:
+                    self.source_cache.record_revalidated(entry)
+                    return entry
+                response.raise_for_status()
+                body = self._read_source(response)
+        SOURCE_BYTES.inc(len(body))
+        _count_request_memory(len(body))
+        
+        self.source_cache.record_miss()
+        entry = SourceEntry(body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        self.source_cache.store(url, entry)
+        return entry
+    
+    def _read_source(self, response: requests.Response) -> bytes:
+        """Lê o corpo em blocos, recusando respostas acima de max_source_mb
+        
+        O Content-Length declarado é verificado antes de ler qualquer byte; sem
+        ele (ou se for falso), a leitura é interrompida ao passar do limite.
+        """
+        limit = self.settings.max_source_bytes
+        limit_mb = limit // (1024 * 1024)
+        declared = response.headers.get('Content-Length', '')
+        if declared.isdigit() and int(declared) > limit:
+            ERRORS.labels('source_limit').inc()
+            raise SourceTooLarge(f"resposta de {int(declared)} bytes excede o limite de {limit_mb} MB")
+        
+        chunks, size = [], 0
+        for chunk in response.iter_content(self.READ_CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                ERRORS.labels('source_limit').inc()
+                raise SourceTooLarge(f"resposta excede o limite de {limit_mb} MB")
+            chunks.append(chunk)
+        return b''.join(chunks)
+    
+    @classmethod
+    def open_image(cls, data: bytes, target_size: Optional[Tuple[int, int]] = None,
+                   resample: str = DEFAULT_RESAMPLE, fit: str = 'contain',
+                   max_pixels: Optional[int] = None) -> Tuple[Image.Image, Optional[Tuple[int, int]]]:
+        """Abre a imagem lendo apenas o cabeçalho, sem decodificar os pixels
+        
+        Recusa imagens acima de max_pixels pelas dimensões declaradas e, para
+        JPEG, configura o modo draft; retorna a imagem e o tamanho mínimo
+        necessário para a célula (None para resolução total).
+        """
+        image = Image.open(io.BytesIO(data))
+        if max_pixels and image.width * image.height > max_pixels:
+            ERRORS.labels('source_limit').inc()
+            raise SourceTooLarge(
+                f"imagem de {image.width}x{image.height} excede o limite de {max_pixels // 1_000_000} megapixels"
+            )
+        
+        draft_gap = RESAMPLE_TIERS[resample]['draft_gap']
+        if not (target_size and draft_gap):
+            return image, None
+        fit_width, fit_height = cls.scaled_size(image.width, image.height, *target_size, fit)
+        needed = (math.ceil(fit_width * draft_gap), math.ceil(fit_height * draft_gap))
+        image.draft('RGB', needed)
+        return image, needed
+    
+    @contextmanager
+    def _decode_reservation(self, body: bytes, target_size: Optional[Tuple[int, int]] = None,
+                            resample: str = DEFAULT_RESAMPLE, fit: str = 'contain'):
+        """Valida o cabeçalho da origem e reserva a memória estimada da decodificação
+        
+        A estimativa considera o modo draft do JPEG e a conversão para RGB.
+        """
+        image, _ = self.open_image(body, target_size, resample, fit, self.settings.max_source_pixels)
+        bands = len(image.getbands()) + (0 if image.mode == 'RGB' else 3)
+        size = image.width * image.height * bands
+        
+        with self.decode_budget.reserve(size, self.settings.timeout) if self.decode_budget is not None else nullcontext():
+            usage = _request_memory.get()
+            if usage is not None:
+                usage.add(size)
+            try:
+                yield
+            finally:
+                if usage is not None:
+                    usage.release(size)
+    
+    @classmethod
+    def decode_image(cls, data: bytes, target_size: Optional[Tuple[int, int]] = None,
+                     resample: str = DEFAULT_RESAMPLE, fit: str = 'contain') -> Image.Image:
+        """Decodifica a imagem em RGB, já reduzida para perto do tamanho alvo
+        
+        Para JPEG usa o modo draft (escala DCT na decodificação) e em seguida
+        Image.reduce, deixando para o filtro final apenas o último ajuste.
+        """
+        with STAGE_SECONDS.labels('decode').time():
+            image, needed = cls.open_image(data, target_size, resample, fit)
+            if needed:
+                image.load()
+                factor = min(image.width // needed[0], image.height // needed[1])
+                if factor >= 2:
+                    image = image.reduce(factor)
+            image.load()
+        
+        # Converte para RGB se necessário (para evitar problemas com PNG transparente)
+        if image.mode != 'RGB':
+            with STAGE_SECONDS.labels('convert').time():
+                image = image.convert('RGB')
+        return image
+    
+    def download_image(self, url: str, target_size: Optional[Tuple[int, int]] = None,
+                       resample: str = DEFAULT_RESAMPLE, fit: str = 'contain',
+                       revalidate: bool = False) -> Image.Image:
+        """Baixa uma imagem de uma URL e retorna um objeto PIL Image em RGB
+        
+        A imagem decodificada fica junto da entrada do cache de origem, então
+        um hit ou um 304 não precisa decodificar de novo a mesma geometria.
+        """
+        try:
+            entry = self.fetch_source(url, revalidate)
+            return self._entry_image(url, entry, target_size, resample, fit)
+        except Exception as e:
+            ERRORS.labels('download').inc()
+            raise Exception(f"Erro ao baixar imagem de {url}: {str(e)}")
+    
+    def _entry_image(self, url: str, entry: SourceEntry, target_size: Optional[Tuple[int, int]] = None,
+                     resample: str = DEFAULT_RESAMPLE, fit: str = 'contain') -> Image.Image:
+        """Imagem decodificada da entrada, memorizada junto dela no cache de origem"""
+        decode_key = (target_size, resample, fit) if target_size else None
+        image = entry.images.get(decode_key)
+        if image is None:
+            with self._decode_reservation(entry.body, target_size, resample, fit):
+                image = self.decode_image(entry.body, target_size, resample, fit)
+            entry.add_image(decode_key, image)
+            self.source_cache.store(url, entry)
+        return image
+    
+    def _count_tile(self, tier: str, outcome: str):
+        with self._tile_lock:
+            self.tile_stats[tier][outcome] += 1
+        CACHE_REQUESTS.labels(tier, outcome).inc()
+    
+    def download_tile(self, url: str, cell_width: int, cell_height: int, resample: str = DEFAULT_RESAMPLE,
+                      fit: str = 'contain', revalidate: bool = False) -> Tuple[str, Image.Image]:
+        """Baixa a origem e retorna o hash do conteúdo e a célula já redimensionada
+        
+        A célula é reaproveitada do cache de células enquanto o conteúdo da
+        origem não mudar: só as origens com quadro novo são decodificadas e
+        redimensionadas de novo.
+        """
+        try:
+            entry = self.fetch_source(url, revalidate)
+            return entry.digest, self._entry_tile(url, entry, cell_width, cell_height, resample, fit)
+        except Exception as e:
+            ERRORS.labels('download').inc()
+            raise Exception(f"Erro ao baixar imagem de {url}: {str(e)}")
+    
+    def _entry_tile(self, url: str, entry: SourceEntry, cell_width: int, cell_height: int,
+                    resample: str = DEFAULT_RESAMPLE, fit: str = 'contain') -> Image.Image:
+        """Célula redimensionada da entrada, via cache de células
+        
+        Com o cache de células desabilitado, a célula fica memorizada junto da
+        entrada no cache de origem (como em _entry_image): um hit ou um 304
+        continua sem decodificar de novo.
+        """
+        tile_key = f"tile:{entry.digest}:{cell_width}x{cell_height}:{resample}:{fit}"
+        if self.tile_cache is not None:
+            tile = self.tile_cache.get(tile_key)
+        else:
+            tile = entry.images.get(tile_key)
+        if tile is not None:
+            self._count_tile('tile', 'hits')
+            return tile
+        
+        self._count_tile('tile', 'misses')
+        with self._decode_reservation(entry.body, (cell_width, cell_height), resample, fit):
+            if self.cpu_pool is not None:
+                size, pixels = self.cpu_pool.run(_cpu_tile, entry.body, cell_width, cell_height, resample, fit)
+                tile = Image.frombuffer('RGB', size, pixels, 'raw', 'RGB', 0, 1)
+            else:
+                image = self.decode_image(entry.body, (cell_width, cell_height), resample, fit)
+                with STAGE_SECONDS.labels('resize').time():
+                    tile = self.resize_image_to_fit(image, cell_width, cell_height, resample, fit)
+        if self.tile_cache is not None:
+            self.tile_cache.set(tile_key, tile, tile.width * tile.height * len(tile.getbands()))
+        else:
+            entry.add_image(tile_key, tile)
+            self.source_cache.store(url, entry)
+        return tile
+    
+    def download_tiles(self, urls: List[str], cell_width: int, cell_height: int,
+                       resample: str = DEFAULT_RESAMPLE, fit: str = 'contain',
+                       revalidate: bool = False) -> List[Tuple[str, Image.Image]]:
+        """Obtém as células de todas as URLs em paralelo, na ordem das URLs"""
+        return self._download_all(self.download_tile, urls, cell_width, cell_height, resample, fit, revalidate)
+    
+    def fetch_sources(self, urls: List[str], revalidate: bool = False) -> List[SourceEntry]:
+        """Baixa as origens de todas as URLs em paralelo, na ordem das URLs
+        
+        Só rede: a decodificação fica para source_tiles, que roda com a vaga
+        do pool de CPU já reservada.
+        """
+        return self._download_all(self._fetch_for_render, urls, revalidate)
+    
+    def _fetch_for_render(self, url: str, revalidate: bool = False) -> SourceEntry:
         try:
-            response = requests.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            return Image.open(io.BytesIO(response.content))
+            return self.fetch_source(url, revalidate)
         except Exception as e:
+            ERRORS.labels('download').inc()
             raise Exception(f"Erro ao baixar imagem de {url}: {str(e)}")
     
-    def resize_image_to_fit(self, image: Image.Image, target_width: int, target_height: int) -> Image.Image:
-        """Redimensiona a imagem mantendo a proporção para caber no espaço alvo"""
+    def source_tiles(self, urls: List[str], entries: List[SourceEntry], cell_width: int, cell_height: int,
+                     resample: str = DEFAULT_RESAMPLE, fit: str = 'contain') -> List[Tuple[str, Image.Image]]:
+        """Células (hash, imagem) das origens já baixadas, decodificadas em paralelo na ordem das URLs"""
+        cells = self._run_each({
+            index: (self._entry_tile, url, entry, cell_width, cell_height, resample, fit)
+            for index, (url, entry) in enumerate(zip(urls, entries))
+        }, self.settings.timeout)
+        tiles = []
+        for url, entry, tile in zip(urls, entries, cells.values()):
+            if isinstance(tile, Exception):
+                ERRORS.labels('download').inc()
+                raise Exception(f"Erro ao baixar imagem de {url}: {str(tile)}")
+            tiles.append((entry.digest, tile))
+        return tiles
+    
+    def download_images(self, urls: List[str], target_size: Optional[Tuple[int, int]] = None,
+                        resample: str = DEFAULT_RESAMPLE, fit: str = 'contain',
+                        revalidate: bool = False) -> List[Image.Image]:
+        """Baixa todas as imagens em paralelo, mantendo a ordem das URLs"""
+        return self._download_all(self.download_image, urls, target_size, resample, fit, revalidate)
+    
+    def _download_all(self, fn, urls: List[str], *args) -> list:
+        """Executa fn(url, *args) para cada URL no pool de downloads
+        
+        Cada download respeita o `timeout` individualmente e o conjunto inteiro
+        tem o mesmo `timeout` como prazo total.
+        """
+        if len(urls) == 1:
+            return [fn(urls[0], *args)]
+        
+        # Cada tarefa leva uma cópia do contexto (memória da renderização em andamento)
+        futures = [self.download_executor.submit(contextvars.copy_context().run, fn, url, *args) for url in urls]
+        done, pending = wait(futures, timeout=self.settings.timeout, return_when=FIRST_EXCEPTION)
+        
+        # Cancela o que ainda estiver na fila se algo falhou ou o prazo acabou
+        for future in pending:
+            future.cancel()
+        
+        results = []
+        for url, future in zip(urls, futures):
+            if future in done:
+                # Propaga a exceção do download, se houver
+                results.append(future.result())
+                continue
+            if any(f.exception() for f in done):
+                # Outro download já falhou; relata a primeira falha
+                next(f for f in futures if f in done and f.exception()).result()
+            raise Exception(f"Erro ao baixar imagem de {url}: prazo total de {self.settings.timeout}s excedido")
+        return results
+    
+    def _run_each(self, calls: dict, timeout: Optional[float] = None) -> dict:
+        """Executa cada chamada (fn, *args) no pool de downloads
+        
+        Diferente de _download_all, uma falha não cancela as demais: o
+        resultado de cada nome é o valor retornado ou a exceção levantada.
+        """
+        futures = {
+            name: self.download_executor.submit(contextvars.copy_context().run, *call)
+            for name, call in calls.items()
+        }
+        done, pending = wait(futures.values(), timeout=timeout)
+        for future in pending:
+            future.cancel()
+        
+        results = {}
+        for name, future in futures.items():
+            if future in done:
+                error = future.exception()
+                results[name] = error if error is not None else future.result()
+            else:
+                results[name] = TimeoutError(f"prazo total de {timeout}s excedido")
+        return results
+    
+    @staticmethod
+    def fit_size(width: int, height: int, target_width: int, target_height: int) -> Tuple[int, int]:
+        """Calcula o tamanho que cabe no espaço alvo mantendo a proporção"""
         # Calcula a proporção para manter aspect ratio
-        img_ratio = image.width / image.height
+        img_ratio = width / height
         target_ratio = target_width / target_height
         
         if img_ratio > target_ratio:
             # Imagem é mais larga, ajustar pela largura
-            new_width = target_width
-            new_height = int(target_width / img_ratio)
+            return target_width, int(target_width / img_ratio)
+        # Imagem é mais alta, ajustar pela altura
+        return int(target_height * img_ratio), target_height
+    
+    @classmethod
+    def scaled_size(cls, width: int, height: int, target_width: int, target_height: int,
+                    fit: str = 'contain') -> Tuple[int, int]:
+        """Tamanho da imagem inteira após a escala do modo de encaixe
+        
+        contain: cabe inteira no espaço alvo; cover: cobre todo o espaço alvo.
+        """
+        if fit == 'cover':
+            scale = max(target_width / width, target_height / height)
+            return math.ceil(width * scale), math.ceil(height * scale)
+        return cls.fit_size(width, height, target_width, target_height)
+    
+    @classmethod
+    def resize_image_to_fit(cls, image: Image.Image, target_width: int, target_height: int,
+                            resample: str = DEFAULT_RESAMPLE, fit: str = 'contain') -> Image.Image:
+        """Redimensiona a imagem mantendo a proporção para caber no espaço alvo
+        
+        No modo cover a imagem preenche todo o espaço; o recorte central é
+        feito pelo próprio resize (parâmetro box), sem imagem intermediária.
+        """
+        resample_filter = RESAMPLE_TIERS[resample]['filter']
+        if fit == 'cover':
+            scale = max(target_width / image.width, target_height / image.height)
+            box_width, box_height = target_width / scale, target_height / scale
+            left = (image.width - box_width) / 2
+            top = (image.height - box_height) / 2
+            box = (left, top, left + box_width, top + box_height)
+            return image.resize((target_width, target_height), resample_filter, box=box)
+        
+        new_size = cls.fit_size(image.width, image.height, target_width, target_height)
+        return image.resize(new_size, resample_filter)
+    
+    def _resolve_layout(self, num_images: int, layout: Optional[dict], base: dict) -> dict:
+        """Calcula grade, tamanho das células e modo de encaixe da requisição
+        
+        Sem parâmetros, mantém o layout automático (1 imagem no tamanho
+        original, 2 lado a lado, 3-4 em 2x2, mais que isso em grade quadrada)
+        com as células da configuração.
+        """
+        layout = layout or {}
+        for name in ('cols', 'rows', 'width', 'height'):
+            value = layout.get(name)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value <= 0):
+                raise ValueError(f'"{name}" deve ser um inteiro positivo')
+        
+        fit = layout.get('fit') or 'contain'
+        if fit not in FIT_MODES:
+            raise ValueError(f'"fit" deve ser um de: {", ".join(FIT_MODES)}')
+        
+        cols, rows = layout.get('cols'), layout.get('rows')
+        width, height = layout.get('width'), layout.get('height')
+        
+        if cols is None and rows is None:
+            if num_images <= 2:
+                cols, rows = num_images, 1
+            elif num_images <= 4:
+                cols, rows = 2, 2
+            else:
+                cols = math.ceil(math.sqrt(num_images))
+                rows = math.ceil(num_images / cols)
+        elif cols is None:
+            cols = math.ceil(num_images / rows)
+        elif rows is None:
+            rows = math.ceil(num_images / cols)
+        
+        if cols * rows < num_images:
+            raise ValueError(f"Grade {cols}x{rows} não comporta {num_images} imagens")
+        if cols * rows > MAX_TILES:
+            raise ValueError(f"Grade {cols}x{rows} excede o máximo de {MAX_TILES} células")
+        
+        for name, value in (('width', width), ('height', height)):
+            if value is not None and value > MAX_OUTPUT_SIZE:
+                raise ValueError(f'"{name}" deve ser no máximo {MAX_OUTPUT_SIZE}')
+        
+        # Tamanho da célula: derivado do tamanho de saída pedido, mantendo a
+        # proporção das células da configuração quando só uma dimensão é dada
+        if width is not None and height is not None:
+            cell_width, cell_height = width // cols, height // rows
+        elif width is not None:
+            cell_width = width // cols
+            cell_height = round(cell_width * base['cell_height'] / base['cell_width'])
+        elif height is not None:
+            cell_height = height // rows
+            cell_width = round(cell_height * base['cell_width'] / base['cell_height'])
         else:
-            # Imagem é mais alta, ajustar pela altura
-            new_height = target_height
-            new_width = int(target_height * img_ratio)
+            cell_width, cell_height = base['cell_width'], base['cell_height']
         
-        return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        if cell_width <= 0 or cell_height <= 0:
+            raise ValueError("Tamanho de saída pequeno demais para a grade")
+        
+        return {
+            'cols': cols,
+            'rows': rows,
+            'cell_width': cell_width,
+            'cell_height': cell_height,
+            'fit': fit,
+            # Uma única imagem sem parâmetros de layout mantém o tamanho original
+            'original_size': num_images == 1 and not layout
+        }
     
-    def combine_images(self, image_urls: List[str]) -> tuple[bytes, Optional[str]]:
-        """Combina as imagens em uma única imagem e retorna os bytes e chave do cache"""
+    def _build_config(self, image_urls: List[str], resample: Optional[str], fmt: Optional[str],
+                      layout: Optional[dict] = None) -> dict:
+        """Valida a requisição e retorna a configuração efetiva da renderização"""
         if not image_urls:
             raise ValueError("Lista de URLs não pode estar vazia")
         
-        if len(image_urls) > self.max_images:
-            raise ValueError(f"Máximo de {self.max_images} imagens permitidas")
+        config = self.get_config_dict(resample, fmt)
+        if len(image_urls) > config['max_images']:
+            raise ValueError(f"Máximo de {config['max_images']} imagens permitidas")
+        
+        if config['resample'] not in RESAMPLE_TIERS:
+            raise ValueError(f"resample deve ser um de: {', '.join(RESAMPLE_TIERS)}")
+        if config['format'] not in available_formats():
+            raise ValueError(f"format deve ser um de: {', '.join(available_formats())}")
+        
+        # Layout e tamanho de saída fazem parte da chave do cache
+        config.update(self._resolve_layout(len(image_urls), layout, config))
+        return config
+    
+    def encode_options(self, fmt: str, config: Optional[dict] = None) -> dict:
+        """Opções do encoder para o formato de saída
+        
+        Usa a qualidade e o modo JPEG da configuração da requisição (a mesma
+        da chave do cache), para não misturar valores durante uma recarga.
+        """
+        config = config or self.get_config_dict()
+        quality = config['image_quality']
+        if fmt == 'jpeg':
+            options = {'quality': quality}
+            if config['jpeg_mode'] in ('optimized', 'progressive'):
+                options['optimize'] = True
+            if config['jpeg_mode'] == 'progressive':
+                options['progressive'] = True
+            return options
+        if fmt == 'webp':
+            return {'quality': quality, 'method': 4}
+        return {'quality': quality}
+    
+    def encode_image(self, image: Image.Image, fmt: str, config: Optional[dict] = None) -> bytes:
+        """Codifica a imagem final no formato de saída, registrando o custo"""
+        started = time.perf_counter()
+        image_data = encode_to_bytes(image, fmt, self.encode_options(fmt, config))
+        self._record_encode(fmt, time.perf_counter() - started, image_data)
+        return image_data
+    
+    def _record_encode(self, fmt: str, elapsed: float, image_data: bytes):
+        _count_request_memory(len(image_data))
+        STAGE_SECONDS.labels('encode').observe(elapsed)
+        OUTPUT_BYTES.labels(fmt).inc(len(image_data))
+        with self._encode_lock:
+            stats = self.encode_stats.setdefault(fmt, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            stats['bytes'] += len(image_data)
+    
+    def get_encode_stats(self) -> dict:
+        """Custo médio de codificação e tamanho médio por formato de saída"""
+        with self._encode_lock:
+            return {
+                fmt: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['seconds'] / stats['count'] * 1000, 2),
+                    'avg_bytes': stats['bytes'] // stats['count']
+                }
+                for fmt, stats in self.encode_stats.items()
+            }
+    
+    def _publish_job_status(self, job: RenderJob):
+        self.cache.set_job_status(job.key, job.status, job.error, ttl=self.cache.ttl)
+    
+    def submit_render(self, image_urls: List[str], resample: Optional[str] = None,
+                      fmt: Optional[str] = None, layout: Optional[dict] = None) -> tuple[str, str]:
+        """Enfileira a renderização e retorna imediatamente a chave e o status
+        
+        Se a imagem já está no cache, nada é enfileirado e o status é "done".
+        Levanta RenderQueueFull quando a fila está cheia.
+        """
+        config = self._build_config(image_urls, resample, fmt, layout)
+        key = self.cache._generate_key(image_urls, config)
+        
+        if self.cache.peek(key):
+            return key, 'done'
+        
+        job = self.render_queue.submit(key, lambda: self.combine_images(image_urls, resample, fmt, layout))
+        return key, job.status
+    
+    def get_job_status(self, key: str) -> Optional[dict]:
+        """Status do job: local, publicado por outro worker no Redis, ou já no cache"""
+        job = self.render_queue.get(key)
+        if job is not None:
+            return job.to_dict()
+        status = self.cache.get_job_status(key)
+        if status is not None:
+            status['key'] = key
+            return status
+        if self.cache.peek(key):
+            return {'key': key, 'status': 'done'}
+        return None
+    
+    def wait_for_image(self, key: str, timeout: float) -> Optional[CachedImage]:
+        """Aguarda (long-poll) a renderização pendente da chave terminar, até o timeout
         
+        Acompanha o job deste worker, o status publicado no Redis por outro
+        worker e o lock de renderização, mantido também pelas renderizações
+        que não publicam status (síncronas e renovações de combos).
+        """
+        deadline = time.monotonic() + timeout
+        job = self.render_queue.get(key)
+        if job is not None:
+            job.done.wait(timeout)
+        while time.monotonic() < deadline:
+            entry = self.cache.get_image_entry(key)
+            if entry is not None:
+                return entry
+            status = self.cache.get_job_status(key)
+            pending = status is not None and status['status'] in ('queued', 'rendering')
+            if not pending and not self.cache.is_rendering(key):
+                break
+            time.sleep(0.1)
+        return self.cache.get_image_entry(key)
+    
+    def combine_images(self, image_urls: List[str], resample: Optional[str] = None,
+                       fmt: Optional[str] = None, layout: Optional[dict] = None) -> tuple[bytes, Optional[str]]:
+        """Combina as imagens em uma única imagem e retorna os bytes e chave do cache"""
         # Verifica cache primeiro
-        config = self.get_config_dict()
+        config = self._build_config(image_urls, resample, fmt, layout)
         cached_image = self.cache.get_cached_image(image_urls, config)
         if cached_image:
             # Se encontrou no cache, retorna a chave também
             cache_key = self.cache._generate_key(image_urls, config)
             return cached_image, cache_key
         
-        # Baixa todas as imagens
-        images = []
-        for url in image_urls:
-            img = self.download_image(url)
-            # Converte para RGB se necessário (para evitar problemas com PNG transparente)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            images.append(img)
+        # Requisições idênticas simultâneas compartilham uma única renderização
+        key = self.cache._generate_key(image_urls, config)
+        return self.single_flight.do(key, lambda: self._render_once(key, image_urls, config))
+    
+    def combine_batch(self, items: List[Tuple[List[str], Optional[str], Optional[str], Optional[dict]]]) -> List[dict]:
+        """Combina vários pedidos (urls, resample, fmt, layout) de uma vez
+        
+        As chaves são consultadas em um único MGET e as que faltam são
+        renderizadas juntas: cada URL distinta é baixada uma vez e cada célula
+        distinta é decodificada uma vez, mesmo se aparecer em vários pedidos.
+        As imagens novas são gravadas em um único pipeline. Uma falha afeta
+        apenas os pedidos que dependem dela.
+        """
+        results = []
+        jobs: Dict[str, Tuple[List[str], dict]] = {}
+        for urls, resample, fmt, layout in items:
+            try:
+                config = self._build_config(urls, resample, fmt, layout)
+            except ValueError as e:
+                results.append({'key': None, 'status': 'invalid', 'error': str(e)})
+                continue
+            key = self.cache._generate_key(urls, config)
+            # Pedidos idênticos no mesmo lote viram uma única renderização
+            jobs.setdefault(key, (urls, config))
+            results.append({'key': key, 'format': config['format'], 'urls_count': len(urls)})
         
-        num_images = len(images)
+        cached = self.cache.get_many(list(jobs))
+        pending = {key: job for key, job in jobs.items() if key not in cached}
+        rendered, errors = {}, {}
+        if pending:
+            rendered, errors = self._render_batch(pending)
+        stored = set(self.cache.store_many([
+            (key, image_data, pending[key][1]['format']) for key, image_data in rendered.items()
+        ]))
         
-        # Define o layout baseado no número de imagens
-        if num_images == 1:
-            combined_image = images[0]
-        else:
-            if num_images == 2:
-                # Layout horizontal: 2x1
-                grid_cols, grid_rows = 2, 1
-            elif num_images == 3:
-                # Layout: 2x2 com uma posição vazia
-                grid_cols, grid_rows = 2, 2
-            else:  # 4 imagens
-                # Layout: 2x2
-                grid_cols, grid_rows = 2, 2
+        for result in results:
+            key = result['key']
+            if key in cached:
+                result.update(status='cached', image_size=len(cached[key]))
+            elif key in rendered:
+                result.update(status='rendered', image_size=len(rendered[key]))
+                if key not in stored:
+                    # Sem cache a imagem não pode ser recuperada depois
+                    result['key'] = None
+            elif key is not None:
+                result.update(key=None, status='error', error=errors[key])
+        return results
+    
+    def _render_batch(self, jobs: Dict[str, Tuple[List[str], dict]]) -> Tuple[Dict[str, bytes], Dict[str, str]]:
+        """Renderiza as chaves do lote compartilhando downloads e células
+        
+        Retorna as imagens renderizadas e a mensagem de erro de cada chave que falhou.
+        """
+        # Cada URL distinta é baixada uma única vez
+        urls = list(dict.fromkeys(url for image_urls, _ in jobs.values() for url in image_urls))
+        sources = self._run_each({url: (self.fetch_source, url) for url in urls}, self.settings.timeout)
+        for entry in sources.values():
+            if isinstance(entry, Exception):
+                ERRORS.labels('download').inc()
+        
+        # A vaga do pool de CPU só é reservada depois dos downloads
+        with self._cpu_admission():
+            return self._render_batch_sources(jobs, sources)
+    
+    def _render_batch_sources(self, jobs: Dict[str, Tuple[List[str], dict]],
+                              sources: dict) -> Tuple[Dict[str, bytes], Dict[str, str]]:
+        """Decodifica, compõe e codifica as chaves do lote a partir das origens já baixadas"""
+        # Cada célula distinta (conteúdo da origem + geometria) é decodificada uma única vez
+        def cell_name(url: str, config: dict) -> tuple:
+            return (sources[url].digest, config['cell_width'], config['cell_height'], config['resample'], config['fit'])
+        
+        cells = {}
+        for image_urls, config in jobs.values():
+            if config['original_size']:
+                continue
+            for url in image_urls:
+                if not isinstance(sources[url], Exception):
+                    name = cell_name(url, config)
+                    cells[name] = (self._entry_tile, url, sources[url], *name[1:])
+        images = self._run_each(cells)
+        for image in images.values():
+            if isinstance(image, Exception):
+                ERRORS.labels('download').inc()
+        
+        def compose(image_urls: List[str], config: dict) -> bytes:
+            if config['original_size']:
+                url = image_urls[0]
+                try:
+                    if isinstance(sources[url], Exception):
+                        raise sources[url]
+                    return self._encode_original(url, sources[url], config)
+                except Exception as e:
+                    raise Exception(f"Erro ao baixar imagem de {url}: {str(e)}")
+            for url in image_urls:
+                error = sources[url] if isinstance(sources[url], Exception) else images[cell_name(url, config)]
+                if isinstance(error, Exception):
+                    raise Exception(f"Erro ao baixar imagem de {url}: {str(error)}")
+            tiles = [(sources[url].digest, images[cell_name(url, config)]) for url in image_urls]
+            return self._compose_tiles(tiles, config)
+        
+        # Composição e codificação de cada chave em paralelo
+        outcomes = self._run_each({key: (compose, *job) for key, job in jobs.items()})
+        rendered = {key: value for key, value in outcomes.items() if not isinstance(value, Exception)}
+        errors = {key: str(value) for key, value in outcomes.items() if isinstance(value, Exception)}
+        return rendered, errors
+    
+    def _render_once(self, key: str, image_urls: List[str], config: dict) -> tuple[bytes, Optional[str]]:
+        """Renderiza a combinação coordenando com os outros workers via Redis
+        
+        Quem adquire o lock da chave renderiza; os demais aguardam a imagem
+        aparecer no cache. Se o lock expirar sem resultado, tentam de novo.
+        """
+        lock_ttl = self.settings.timeout * 2 + 10
+        deadline = time.monotonic() + lock_ttl
+        
+        while True:
+            lock = self.cache.try_render_lock(key, lock_ttl)
+            if lock is False:
+                # Sem Redis para coordenar: renderiza localmente
+                return self._render(image_urls, config)
             
-            # Cria a imagem final
-            final_width = grid_cols * self.cell_width
-            final_height = grid_rows * self.cell_height
-            combined_image = Image.new('RGB', (final_width, final_height), 'white')
+            if lock is not None:
+                try:
+                    # Outro worker pode ter terminado entre o MISS e o lock
+                    cached_image = self.cache.peek(key)
+                    if cached_image:
+                        return cached_image, key
+                    return self._render(image_urls, config)
+                finally:
+                    self.cache.release_render_lock(lock)
             
-            # Posiciona as imagens na grade
-            for i, img in enumerate(images):
-                # Redimensiona a imagem para caber na célula
-                resized_img = self.resize_image_to_fit(img, self.cell_width, self.cell_height)
-                
-                # Calcula a posição na grade
-                col = i % grid_cols
-                row = i // grid_cols
-                
-                # Calcula a posição de colagem (centralizada na célula)
-                x = col * self.cell_width + (self.cell_width - resized_img.width) // 2
-                y = row * self.cell_height + (self.cell_height - resized_img.height) // 2
-                
-                # Cola a imagem na posição calculada
-                combined_image.paste(resized_img, (x, y))
-        
-        # Converte para bytes
-        img_buffer = io.BytesIO()
-        combined_image.save(img_buffer, format='JPEG', quality=self.image_quality)
-        image_data = img_buffer.getvalue()
+            # Outro worker está renderizando a mesma chave: aguarda o resultado
+            while time.monotonic() < deadline:
+                cached_image = self.cache.peek(key)
+                if cached_image:
+                    with self._stats_lock:
+                        self.coalesced_remote += 1
+                    access_logger.info("🤝 Render shared with another worker: %s...", key[:16])
+                    return cached_image, key
+                if not self.cache.is_rendering(key):
+                    # Lock liberado ou expirado sem resultado: tenta adquirir de novo
+                    break
+                time.sleep(0.05)
+            else:
+                return self._render(image_urls, config)
+    
+    def _render(self, image_urls: List[str], config: dict) -> tuple[bytes, Optional[str]]:
+        """Renderiza a combinação e a armazena no cache"""
+        image_data = self._compose(image_urls, config)
         
         # Armazena no cache e obtém a chave
         cache_key = self.cache.cache_image(image_urls, config, image_data)
         
         return image_data, cache_key
+    
+    def _compose(self, image_urls: List[str], config: dict, revalidate: bool = False) -> bytes:
+        """Baixa, redimensiona, combina e codifica as imagens
+        
+        revalidate consulta as origens mesmo dentro do TTL do cache de origem
+        (renovação de combos, que precisa de quadros novos das câmeras).
+        """
+        resample, fit = config['resample'], config['fit']
+        cell_width, cell_height = config['cell_width'], config['cell_height']
+        
+        # Downloads antes de reservar a vaga do pool de CPU: uma origem lenta
+        # não deve ocupar a vaga de quem só precisa de CPU
+        entries = self.fetch_sources(image_urls, revalidate)
+        with self._cpu_admission():
+            if config['original_size']:
+                # Uma imagem sozinha sem layout mantém a resolução original
+                url = image_urls[0]
+                try:
+                    return self._encode_original(url, entries[0], config)
+                except Exception as e:
+                    ERRORS.labels('download').inc()
+                    raise Exception(f"Erro ao baixar imagem de {url}: {str(e)}")
+            
+            # Células de todas as origens em paralelo; só as origens com conteúdo
+            # novo são decodificadas e redimensionadas
+            tiles = self.source_tiles(image_urls, entries, cell_width, cell_height, resample, fit)
+            return self._compose_tiles(tiles, config)
+    
+    def _cpu_admission(self):
+        """Vaga no pool de CPU para uma renderização (levanta CpuPoolFull se não houver)
+        
+        Requisições são recusadas na hora (503); jobs da fila de renderização,
+        já aceitos, esperam até `timeout` segundos por uma vaga.
+        """
+        if self.cpu_pool is None:
+            return nullcontext()
+        if _background_render.get():
+            return self.cpu_pool.admit(self.settings.timeout)
+        return self.cpu_pool.admit()
+    
+    def _encode_original(self, url: str, entry: SourceEntry, config: dict) -> bytes:
+        """Codifica a origem em tamanho original no formato de saída"""
+        fmt = config['format']
+        if self.cpu_pool is not None:
+            with self._decode_reservation(entry.body, None, config['resample']):
+                image_data, elapsed = self.cpu_pool.run(
+                    _cpu_transcode, entry.body, config['resample'], fmt, self.encode_options(fmt, config)
+                )
+            self._record_encode(fmt, elapsed, image_data)
+            return image_data
+        return self.encode_image(self._entry_image(url, entry, None, config['resample']), fmt, config)
+    
+    def _compose_tiles(self, tiles: List[Tuple[str, Image.Image]], config: dict) -> bytes:
+        """Cola as células (hash, imagem) na grade e codifica no formato de saída"""
+        # Mesmos conteúdos na mesma ordem e configuração: reaproveita a composição codificada
+        composite_key = f"composite:{self._content_key([digest for digest, _ in tiles], config)}"
+        if self.tile_cache is not None:
+            image_data = self.tile_cache.get(composite_key)
+            if image_data is not None:
+                self._count_tile('composite', 'hits')
+                return image_data
+            self._count_tile('composite', 'misses')
+        
+        if self.cpu_pool is not None:
+            fmt = config['format']
+            raw_tiles = [(tile.size, tile.tobytes()) for _, tile in tiles]
+            image_data, elapsed = self.cpu_pool.run(_cpu_compose, raw_tiles, config, self.encode_options(fmt, config))
+            self._record_encode(fmt, elapsed, image_data)
+        else:
+            combined_image = self.paste_tiles([tile for _, tile in tiles], config)
+            # Converte para bytes no formato de saída
+            image_data = self.encode_image(combined_image, config['format'], config)
+        if self.tile_cache is not None:
+            self.tile_cache.set(composite_key, image_data, len(image_data))
+        return image_data
+    
+    @staticmethod
+    def paste_tiles(tiles: List[Image.Image], config: dict) -> Image.Image:
+        """Cola as células já redimensionadas, centralizadas, na grade da configuração"""
+        cols, rows = config['cols'], config['rows']
+        cell_width, cell_height = config['cell_width'], config['cell_height']
+        
+        # Cria a imagem final uma única vez, já no tamanho de saída
+        combined_image = Image.new('RGB', (cols * cell_width, rows * cell_height), 'white')
+        
+        # Posiciona as células na grade
+        for i, resized_img in enumerate(tiles):
+            # Calcula a posição na grade
+            col = i % cols
+            row = i // cols
+            
+            # Calcula a posição de colagem (centralizada na célula)
+            x = col * cell_width + (cell_width - resized_img.width) // 2
+            y = row * cell_height + (cell_height - resized_img.height) // 2
+            
+            # Cola a imagem na posição calculada
+            with STAGE_SECONDS.labels('paste').time():
+                combined_image.paste(resized_img, (x, y))
+        return combined_image
+    
+    @staticmethod
+    def _content_key(digests: List[str], config: dict) -> str:
+        """Hash dos conteúdos das origens na ordem das células e da configuração"""
+        data = json.dumps({'tiles': digests, 'config': config}, sort_keys=True)
+        return hashlib.md5(data.encode()).hexdigest()
+    
+    def get_tile_stats(self) -> dict:
+        """Hits/misses do cache de células e de composições por conteúdo"""
+        with self._tile_lock:
+            stats = {tier: dict(counts) for tier, counts in self.tile_stats.items()}
+        stats['enabled'] = self.tile_cache is not None
+        if self.tile_cache is not None:
+            stats['entries'] = len(self.tile_cache)
+            stats['bytes_used'] = self.tile_cache.current_bytes
+            stats['max_bytes'] = self.tile_cache.max_bytes
+        return stats
+    
+    def open_stream(self, image_urls: List[str], resample: Optional[str] = None,
+                    layout: Optional[dict] = None, fps: Optional[float] = None,
+                    combo: Optional[Combo] = None) -> LiveStream:
+        """Registra um espectador no loop da combinação, criando o loop se preciso
+        
+        Espectadores da mesma combinação e fps compartilham um único loop.
+        Com combo, usa as URLs e o layout do combo nomeado (sempre em JPEG).
+        Levanta StreamLimitReached com max_stream_viewers espectadores ativos.
+        """
+        if combo is not None:
+            image_urls, config = combo.urls, dict(combo.config, format='jpeg')
+        else:
+            config = self._build_config(image_urls, resample, 'jpeg', layout)
+        settings = self.settings
+        fps = settings.stream_max_fps if fps is None else fps
+        if not 0 < fps <= settings.stream_max_fps:
+            raise ValueError(f"fps deve estar entre 0 e {settings.stream_max_fps}")
+        
+        key = f"{self.cache._generate_key(image_urls, config)}@{fps:g}"
+        with self._streams_lock:
+            self.streams = {name: stream for name, stream in self.streams.items() if not stream.closed}
+            if sum(stream.viewers for stream in self.streams.values()) >= settings.max_stream_viewers:
+                raise StreamLimitReached(f"Máximo de {settings.max_stream_viewers} transmissões simultâneas")
+            stream = self.streams.get(key)
+            if stream is None or not stream.attach():
+                stream = LiveStream(key, list(image_urls), config, fps, self.render_stream_frame)
+                self.streams[key] = stream
+                stream.attach()
+            return stream
+    
+    def render_stream_frame(self, stream: LiveStream) -> Optional[bytes]:
+        """Renderiza um quadro com as opções em vigor, fixadas até o fim do quadro"""
+        # A thread da transmissão não atende requisições: nada fixou as opções antes
+        with pin_settings(self.settings):
+            return self._render_stream_frame(stream)
+    
+    def _render_stream_frame(self, stream: LiveStream) -> Optional[bytes]:
+        """Renderiza um quadro da transmissão; None se nenhuma origem mudou
+        
+        As origens são consultadas em paralelo pela sessão HTTP compartilhada
+        (conexões persistentes) e só as que têm conteúdo novo são
+        decodificadas e redimensionadas; as demais células são reaproveitadas.
+        Uma origem com falha mantém a última célula.
+        """
+        config = stream.config
+        
+        # Consulta as origens antes de reservar a vaga do pool de CPU
+        entries = self._run_each({
+            index: (self.fetch_source, url, True) for index, url in enumerate(stream.urls)
+        }, self.settings.timeout)
+        changed = {}
+        for index, (url, entry) in enumerate(zip(stream.urls, entries.values())):
+            if isinstance(entry, Exception):
+                ERRORS.labels('download').inc()
+                logger.debug("Stream source %s failed: %s", url, entry)
+                continue
+            previous = stream.tiles[index]
+            if previous is None or previous[0] != entry.digest:
+                changed[index] = entry
+        if not changed:
+            return None
+        
+        def update(index: int, entry: SourceEntry):
+            if config['original_size']:
+                tile = self._entry_image(stream.urls[index], entry, None, config['resample'])
+            else:
+                tile = self._entry_tile(stream.urls[index], entry, config['cell_width'], config['cell_height'],
+                                        config['resample'], config['fit'])
+            stream.tiles[index] = (entry.digest, tile)
+        
+        try:
+            with self._cpu_admission():
+                results = self._run_each({
+                    index: (update, index, entry) for index, entry in changed.items()
+                }, self.settings.timeout)
+                for index, result in results.items():
+                    if isinstance(result, Exception):
+                        ERRORS.labels('download').inc()
+                        logger.debug("Stream source %s failed: %s", stream.urls[index], result)
+                if all(isinstance(result, Exception) for result in results.values()):
+                    return None
+                
+                tiles = [tile or ('', Image.new('RGB', (1, 1), 'white')) for tile in stream.tiles]
+                if config['original_size']:
+                    return self.encode_image(tiles[0][1], 'jpeg', config)
+                return self._compose_tiles(tiles, config)
+        except CpuPoolFull:
+            # Pool cheio: pula o quadro, o próximo tenta de novo
+            return None
+    
+    def get_stream_stats(self) -> dict:
+        """Transmissões ativas deste worker"""
+        with self._streams_lock:
+            streams = [stream for stream in self.streams.values() if not stream.closed]
+        settings = self.settings
+        return {
+            'active': len(streams),
+            'viewers': sum(stream.viewers for stream in streams),
+            'max_viewers': settings.max_stream_viewers,
+            'max_fps': settings.stream_max_fps,
+            'streams': [stream.get_stats() for stream in streams]
+        }
+    
+    def combo_for_key(self, key: str) -> Optional[Combo]:
+        """Combo publicado na chave, se houver"""
+        if not key.startswith(RedisCache.COMBO_PREFIX):
+            return None
+        for combo in self.settings.combos.values():
+            if combo.key == key:
+                return combo
+        return None
+    
+    def get_combo_image(self, combo: Combo) -> Optional[CachedImage]:
+        """Imagem do combo com stale-while-revalidate
+        
+        Velha: é servida mesmo assim e uma renovação é enfileirada. Ausente
+        (primeira carga ou Redis fora do ar): renderiza na hora.
+        """
+        if not self.cache.available:
+            entry = self.cache.get_image_entry(combo.key)
+            if entry is not None:
+                return entry
+            return CachedImage(self._compose(combo.urls, combo.config), 0, None)
+        
+        entry = self.cache.get_image_entry(combo.key)
+        if entry is not None:
+            if combo.is_stale(entry):
+                self.schedule_combo_refresh(combo)
+            return entry
+        
+        # Primeira carga: renderiza pela fila (ou reaproveita o job pendente) e
+        # aguarda; se outro worker estiver com o lock, aguarda a imagem dele
+        try:
+            self.render_queue.submit(combo.key, lambda: self.refresh_combo(combo, force=True))
+        except RenderQueueFull:
+            self.refresh_combo(combo, force=True)
+        return self.wait_for_image(combo.key, self.settings.timeout * 2 + 10)
+    
+    def schedule_combo_refresh(self, combo: Combo) -> bool:
+        """Enfileira a renovação do combo (uma por vez por chave)"""
+        try:
+            self.render_queue.submit(combo.key, lambda: self.refresh_combo(combo))
+            return True
+        except RenderQueueFull:
+            logger.warning("⚠️ Render queue full, combo %s refresh postponed", combo.name)
+            return False
+    
+    def refresh_combo(self, combo: Combo, force: bool = False):
+        """Renderiza o combo e o publica na chave estável
+        
+        Não faz nada se outro worker renovou a imagem há pouco ou está
+        renovando agora (lock de renderização no Redis).
+        """
+        if not force:
+            entry = self.cache.get_image_entry(combo.key, with_data=False)
+            if entry is not None and not combo.is_stale(entry, fraction=0.8):
+                return
+        
+        lock = self.cache.try_render_lock(combo.key, self.settings.timeout * 2 + 10)
+        if lock is None:
+            return
+        try:
+            image_data = self._compose(combo.urls, combo.config, revalidate=True)
+            self.cache.store_image_with_custom_key(combo.custom_key, image_data, combo.config['format'], ttl=combo.ttl)
+            combo.last_refresh = time.time()
+            combo.last_error = None
+        except Exception as e:
+            combo.last_error = str(e)
+            raise
+        finally:
+            if lock:
+                self.cache.release_render_lock(lock)
+
+# Instância do combinador de imagens, criada por processo (cada worker do
+# servidor de produção tem o seu próprio combinador e cliente Redis)
+combiner: Optional[ImageCombiner] = None
+_combiner_lock = threading.Lock()
+
+def init_combiner() -> ImageCombiner:
+    """Cria o combinador deste processo, se ainda não existir"""
+    global combiner
+    if combiner is None:
+        with _combiner_lock:
+            if combiner is None:
+                combiner = ImageCombiner()
+    return combiner
+
+@app.before_request
+def ensure_combiner():
+    """Garante o combinador mesmo quando o servidor não chamou init_combiner()"""
+    if combiner is None:
+        init_combiner()
 
-# Instância do combinador de imagens
-combiner = ImageCombiner()
+@app.before_request
+def pin_request_settings():
+    """Fixa as opções em vigor para a requisição inteira (ver ImageCombiner.settings)"""
+    g.settings_token = _request_settings.set(combiner.settings)
+
+@app.teardown_request
+def unpin_request_settings(error: Optional[BaseException] = None):
+    token = g.pop('settings_token', None)
+    if token is not None:
+        _request_settings.reset(token)
+
+def log_startup_info():
+    """Mostra a configuração efetiva do combinador deste processo"""
+    logger.info("🚀 Starting Image Combiner API v1.1.2")
+    settings = combiner.settings
+    logger.info(
+        "📊 Image Configuration: max_images=%s quality=%s cell=%sx%s timeout=%ss resample=%s "
+        "output_format=%s (available: %s)",
+        settings.max_images, settings.image_quality, settings.cell_width, settings.cell_height,
+        settings.timeout, settings.resample, settings.output_format, ', '.join(available_formats())
+    )
+    if combiner.cache.enabled:
+        logger.info(
+            "💾 Cache Configuration: enabled backend=%s ttl=%ss codec=%s (JPEG: %s)",
+            combiner.cache.backend, combiner.cache.ttl, combiner.cache.codec.name,
+            combiner.cache.codec.codec_for('jpeg')
+        )
+    else:
+        logger.info("💾 Cache Configuration: disabled")
+    if combiner.cpu_pool is not None:
+        logger.info("🧮 CPU pool: %d processes, max %d renders in progress",
+                    combiner.cpu_pool.workers, combiner.cpu_pool.max_pending)
+    else:
+        logger.info("🧮 CPU pool: disabled (CPU stages run in the request threads)")
+    logger.info("📝 Logging: level=%s sample_rate=%s", logging.getLevelName(logger.level).lower(), _access_sampler.rate)
+
+def _busy_response(error: Exception) -> Response:
+    """503 com Retry-After para fila de renderização ou pool de CPU cheios"""
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def _with_cache_headers(response: Response, key: str, entry: CachedImage, negotiated: bool = False) -> Response:
+    """ETag forte e Cache-Control limitado ao TTL restante da chave
+    
+    Combos são regravados a cada renovação: max-age vai só até a próxima
+    renovação e a imagem velha pode ser usada enquanto ela acontece.
+    """
+    response.set_etag(entry.etag(key))
+    if negotiated:
+        response.vary.add('Accept')
+    response.cache_control.public = True
+    combo = combiner.combo_for_key(key)
+    if combo is not None:
+        age = combo.age(entry) or 0
+        response.cache_control.max_age = max(0, int(combo.refresh_interval - age))
+        response.cache_control.stale_while_revalidate = combo.refresh_interval
+    else:
+        response.cache_control.max_age = max(0, int(entry.ttl))
+        response.cache_control.immutable = True
+    return response
+
+def _open_cached_file(entry: Optional[CachedImage]):
+    """Abre o arquivo de uma entrada do cache em disco (None se não houver)"""
+    if entry is None or entry.data or not entry.path:
+        return None
+    try:
+        return open(entry.path, 'rb')
+    except FileNotFoundError:
+        return None
 
 @app.route('/image/<key>', methods=['GET'])
 def get_image_by_key(key: str):
@@ -379,29 +3881,181 @@ def get_image_by_key(key: str):
             full_key = f'image_combiner:{key}'
         else:
             full_key = key
+        if full_key.startswith(RedisCache.RESERVED_PREFIX):
+            return jsonify({'error': 'Chave reservada'}), 400
         
-        # Recupera a imagem do cache
-        image_data = combiner.cache.get_image_by_key(full_key)
+        # Chave base: serve a variante de formato pedida (?format=) ou negociada
+        # pelo Accept, quando ela existir no cache
+        negotiated = format_from_key(full_key) == DEFAULT_FORMAT
+        if negotiated:
+            wanted = request.args.get('format') or negotiate_format(request.accept_mimetypes)
+            if wanted in available_formats() and wanted != DEFAULT_FORMAT:
+                candidate = variant_key(full_key, wanted)
+                if combiner.cache.get_image_entry(candidate, with_data=False) is not None:
+                    full_key = candidate
         
-        if image_data:
-            # Retorna a imagem
-            return send_file(
-                io.BytesIO(image_data),
-                mimetype='image/jpeg',
-                as_attachment=False,
-                download_name=f'combined_image_{key[:8]}.jpg'
-            )
+        # Revalidação: responde 304 consultando só TTL e versão, sem ler a imagem
+        if request.if_none_match:
+            entry = combiner.cache.get_image_entry(full_key, with_data=False)
+            if entry is not None and entry.version is not None and entry.etag(full_key) in request.if_none_match:
+                response = Response(status=304)
+                return _with_cache_headers(response, full_key, entry, negotiated)
+        
+        # Recupera a imagem do cache (do disco, só o caminho do arquivo)
+        entry = combiner.cache.get_image_entry(full_key, as_file=True)
+        
+        # Renderização assíncrona pendente: aguarda (long-poll) até ficar pronta
+        if entry is None:
+            job = combiner.get_job_status(full_key)
+            if job is not None and job['status'] in ('queued', 'rendering'):
+                wait = request.args.get('wait', combiner.settings.long_poll_timeout, type=float)
+                entry = combiner.wait_for_image(full_key, max(0, min(wait, combiner.settings.long_poll_timeout)))
+                if entry is None:
+                    job = combiner.get_job_status(full_key) or job
+                    if job['status'] in ('queued', 'rendering'):
+                        response = jsonify({
+                            'key': key,
+                            'status': job['status'],
+                            'message': 'Imagem ainda em renderização, tente novamente'
+                        })
+                        response.status_code = 202
+                        response.headers['Retry-After'] = '1'
+                        return response
+        
+        image_file = _open_cached_file(entry)
+        if image_file is not None:
+            # Arquivo do cache em disco: enviado com sendfile pelo servidor, sem
+            # passar pela memória do processo
+            try:
+                spec = OUTPUT_FORMATS[format_from_key(full_key)]
+                size = os.fstat(image_file.fileno()).st_size
+                response = Response(wrap_file(request.environ, image_file), mimetype=spec['mimetype'],
+                                    direct_passthrough=True)
+                response.content_length = size
+                response.headers['Content-Disposition'] = f'inline; filename=combined_image_{key[:8]}.{spec["extension"]}'
+                _with_cache_headers(response, full_key, entry, negotiated)
+                return response.make_conditional(request, accept_ranges=True, complete_length=size)
+            except BaseException:
+                # Sem resposta (ex.: 416), ninguém mais fecharia o arquivo
+                image_file.close()
+                raise
+        if entry is not None and entry.path and not entry.data:
+            # Arquivo removido entre a consulta e a abertura: lê de novo pelas camadas
+            entry = combiner.cache.get_image_entry(full_key)
+        
+        if entry is not None and entry.data:
+            # Entrega os bytes armazenados diretamente (sem cópia para BytesIO),
+            # com suporte a If-None-Match e Range
+            spec = OUTPUT_FORMATS[format_from_key(full_key)]
+            response = Response(entry.data, mimetype=spec['mimetype'])
+            response.headers['Content-Disposition'] = f'inline; filename=combined_image_{key[:8]}.{spec["extension"]}'
+            _with_cache_headers(response, full_key, entry, negotiated)
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(entry.data))
         else:
             return jsonify({
                 'error': 'Imagem não encontrada ou expirada',
                 'key': key,
                 'message': 'A chave pode ter expirado ou não existir'
             }), 404
-            
+    
+    except HTTPException:
+        # Ex.: 416 de um Range fora do arquivo, com Content-Range: bytes */N
+        raise
     except Exception as e:
         return jsonify({'error': f'Erro ao recuperar imagem: {str(e)}'}), 500
 
+@app.route('/combos', methods=['GET'])
+def list_combos():
+    """Lista os combos configurados e o estado de cada um"""
+    combos = []
+    for combo in combiner.settings.combos.values():
+        info = combo.to_dict()
+        entry = combiner.cache.get_image_entry(combo.key, with_data=False)
+        info['cached'] = entry is not None
+        info['age'] = round(combo.age(entry), 1) if entry is not None and entry.version is not None else None
+        info['stale'] = entry is None or combo.is_stale(entry)
+        combos.append(info)
+    return jsonify({'combos': combos, 'total': len(combos)})
+
+@app.route('/combo/<name>', methods=['GET'])
+def get_combo(name: str):
+    """Imagem de um combo nomeado (stale-while-revalidate)"""
+    combo = combiner.settings.combos.get(name)
+    if combo is None:
+        return jsonify({'error': f'Combo "{name}" não configurado'}), 404
+    try:
+        if request.if_none_match:
+            entry = combiner.cache.get_image_entry(combo.key, with_data=False)
+            if entry is not None and entry.version is not None and entry.etag(combo.key) in request.if_none_match:
+                if combo.is_stale(entry):
+                    combiner.schedule_combo_refresh(combo)
+                return _with_cache_headers(Response(status=304), combo.key, entry)
+        
+        entry = combiner.get_combo_image(combo)
+        if entry is None or not entry.data:
+            return jsonify({'error': f'Combo "{name}" ainda não renderizado, tente novamente'}), 503
+        
+        spec = OUTPUT_FORMATS[combo.config['format']]
+        response = Response(entry.data, mimetype=spec['mimetype'])
+        response.headers['Content-Disposition'] = f'inline; filename={name}.{spec["extension"]}'
+        if entry.version is None:
+            # Renderizado sem cache (Redis indisponível)
+            response.cache_control.no_store = True
+            return response
+        _with_cache_headers(response, combo.key, entry)
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(entry.data))
+    except CpuPoolFull as e:
+        return _busy_response(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return jsonify({'error': f'Erro ao obter combo: {str(e)}'}), 500
+
+def parse_combine_request(data: Any) -> Tuple[List[str], Optional[str], Optional[str], dict]:
+    """Valida os parâmetros de uma combinação (corpo do /combine ou item do lote)
+    
+    Retorna (urls, resample, fmt, layout); levanta ValueError com a mensagem
+    para o cliente.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Cada combinação deve ser um objeto JSON')
+    
+    # Verifica se o parâmetro 'urls' existe
+    if 'urls' not in data:
+        raise ValueError('Parâmetro "urls" é obrigatório')
+    
+    urls = data['urls']
+    
+    # Valida se é uma lista
+    if not isinstance(urls, list):
+        raise ValueError('Parâmetro "urls" deve ser uma lista')
+    
+    # Valida se não está vazia
+    if not urls:
+        raise ValueError('Lista de URLs não pode estar vazia')
+    
+    # Valida o limite de URLs
+    if len(urls) > combiner.settings.max_images:
+        raise ValueError(f'Máximo de {combiner.settings.max_images} URLs permitidas')
+    
+    # Qualidade do redimensionamento (opcional, padrão da configuração)
+    resample = data.get('resample')
+    if resample is not None and resample not in RESAMPLE_TIERS:
+        raise ValueError(f'Parâmetro "resample" deve ser um de: {", ".join(RESAMPLE_TIERS)}')
+    
+    # Formato de saída: campo "format" ("auto" negocia pelo Accept) ou Accept da requisição
+    fmt = data.get('format')
+    if fmt is None or fmt == 'auto':
+        fmt = negotiate_format(request.accept_mimetypes, None if fmt is None else combiner.settings.output_format)
+    if fmt is not None and fmt not in available_formats():
+        raise ValueError(f'Parâmetro "format" deve ser um de: auto, {", ".join(available_formats())}')
+    
+    # Layout e tamanho de saída (opcionais)
+    layout = {name: data[name] for name in ('cols', 'rows', 'width', 'height', 'fit') if name in data}
+    return urls, resample, fmt, layout
+
 @app.route('/combine', methods=['POST'])
+@IN_FLIGHT.track_inprogress()
 def combine_images():
     """Endpoint para combinar imagens - retorna chave única"""
     try:
@@ -410,27 +4064,32 @@ def combine_images():
             return jsonify({'error': 'Content-Type deve ser application/json'}), 400
         
         data = request.get_json()
+        urls, resample, fmt, layout = parse_combine_request(data)
         
-        # Verifica se o parâmetro 'urls' existe
-        if 'urls' not in data:
-            return jsonify({'error': 'Parâmetro "urls" é obrigatório'}), 400
-        
-        urls = data['urls']
-        
-        # Valida se é uma lista
-        if not isinstance(urls, list):
-            return jsonify({'error': 'Parâmetro "urls" deve ser uma lista'}), 400
-        
-        # Valida se não está vazia
-        if not urls:
-            return jsonify({'error': 'Lista de URLs não pode estar vazia'}), 400
-        
-        # Valida o limite de URLs
-        if len(urls) > combiner.max_images:
-            return jsonify({'error': f'Máximo de {combiner.max_images} URLs permitidas'}), 400
+        # Modo assíncrono: devolve a chave imediatamente e renderiza em segundo plano
+        use_async = data.get('async', combiner.async_render)
+        if not isinstance(use_async, bool):
+            return jsonify({'error': 'Parâmetro "async" deve ser true ou false'}), 400
+        if use_async and combiner.cache.available:
+            try:
+                cache_key, status = combiner.submit_render(urls, resample, fmt, layout)
+            except RenderQueueFull as e:
+                return _busy_response(e)
+            
+            return jsonify({
+                'success': True,
+                'key': cache_key,
+                'status': status,
+                'urls_count': len(urls),
+                'cached': status == 'done',
+                'retrieve_url': f'/image/{cache_key}',
+                'status_url': f'/jobs/{cache_key}',
+                'message': 'Imagem já disponível' if status == 'done' else 'Renderização enfileirada'
+            }), 200 if status == 'done' else 202
         
-        # Combina as imagens (com cache automático)
-        image_data, cache_key = combiner.combine_images(urls)
+        # Combina as imagens (com cache automático), medindo o pico de memória estimado
+        with track_request_memory() as memory:
+            image_data, cache_key = combiner.combine_images(urls, resample, fmt, layout)
         
         # Calcula informações da imagem
         image_size = len(image_data)
@@ -440,19 +4099,159 @@ def combine_images():
             'success': True,
             'key': cache_key,
             'image_size': image_size,
+            'format': format_from_key(cache_key) if cache_key else (fmt or combiner.settings.output_format),
             'urls_count': len(urls),
             'cached': cache_key is not None,
             'retrieve_url': f'/image/{cache_key}' if cache_key else None,
+            'peak_memory_bytes': memory.peak,
             'message': 'Imagem combinada com sucesso'
         }
         
         return jsonify(response_data)
         
+    except CpuPoolFull as e:
+        return _busy_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        ERRORS.labels('combine').inc()
+        return jsonify({'error': f'Erro interno: {str(e)}'}), 500
+
+@app.route('/combine/batch', methods=['POST'])
+@IN_FLIGHT.track_inprogress()
+def combine_batch():
+    """Endpoint para combinar vários conjuntos de imagens em uma requisição"""
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type deve ser application/json'}), 400
+        
+        data = request.get_json()
+        combos = data.get('combos') if isinstance(data, dict) else None
+        if not isinstance(combos, list) or not combos:
+            return jsonify({'error': 'Parâmetro "combos" deve ser uma lista não vazia'}), 400
+        if len(combos) > combiner.settings.max_batch_size:
+            return jsonify({'error': f'Máximo de {combiner.settings.max_batch_size} combinações por lote'}), 400
+        
+        # Itens inválidos viram resultados "invalid" sem impedir os demais
+        parsed = []
+        for spec in combos:
+            try:
+                parsed.append(parse_combine_request(spec))
+            except ValueError as e:
+                parsed.append(e)
+        with track_request_memory() as memory:
+            batch = iter(combiner.combine_batch([item for item in parsed if not isinstance(item, ValueError)]))
+        
+        results = []
+        for index, item in enumerate(parsed):
+            if isinstance(item, ValueError):
+                result = {'key': None, 'status': 'invalid', 'error': str(item)}
+            else:
+                result = next(batch)
+            result['index'] = index
+            result['retrieve_url'] = f"/image/{result['key']}" if result['key'] else None
+            results.append(result)
+        
+        counts = {status: sum(1 for result in results if result['status'] == status)
+                  for status in ('cached', 'rendered', 'error', 'invalid')}
+        return jsonify({
+            'success': counts['error'] + counts['invalid'] == 0,
+            'count': len(results),
+            **counts,
+            'peak_memory_bytes': memory.peak,
+            'results': results
+        })
+        
+    except CpuPoolFull as e:
+        return _busy_response(e)
+    except Exception as e:
+        ERRORS.labels('combine').inc()
+        return jsonify({'error': f'Erro interno: {str(e)}'}), 500
+
+# Sem quadro novo, reenvia o último a cada STREAM_KEEPALIVE segundos: mantém
+# proxies com a conexão aberta e detecta espectadores que desconectaram
+STREAM_KEEPALIVE = 10.0
+
+def _stream_parts(stream: LiveStream, release):
+    """Partes multipart/x-mixed-replace com o quadro mais recente do loop"""
+    last_seq, last_sent = 0, time.monotonic()
+    first_deadline = time.monotonic() + combiner.settings.timeout * 2
+    try:
+        while True:
+            frame, seq = stream.next_frame(last_seq, STREAM_KEEPALIVE)
+            if frame is None:
+                if stream.closed or time.monotonic() > first_deadline:
+                    # Nenhuma origem respondeu: encerra em vez de prender a thread
+                    return
+                continue
+            if seq == last_seq and time.monotonic() - last_sent < STREAM_KEEPALIVE:
+                continue
+            last_seq, last_sent = seq, time.monotonic()
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\n'
+                   b'Content-Length: ' + str(len(frame)).encode() + b'\r\n\r\n' + frame + b'\r\n')
+    finally:
+        release()
+
+@app.route('/stream', methods=['GET'])
+def stream_images():
+    """Transmissão MJPEG ao vivo de uma combinação (ou combo nomeado)"""
+    if request.method == 'HEAD':
+        # O Flask aceita HEAD em toda rota GET; aqui abriria uma transmissão sem corpo
+        return jsonify({'error': 'Método HEAD não suportado em /stream'}), 405, {'Allow': 'GET'}
+    try:
+        fps = request.args.get('fps')
+        try:
+            fps = float(fps) if fps is not None else None
+        except ValueError:
+            raise ValueError('Parâmetro "fps" deve ser um número')
+        
+        combo_name = request.args.get('combo')
+        if combo_name is not None:
+            combo = combiner.settings.combos.get(combo_name)
+            if combo is None:
+                return jsonify({'error': f'Combo "{combo_name}" não configurado'}), 404
+            stream = combiner.open_stream(combo.urls, fps=fps, combo=combo)
+        else:
+            # Mesmos parâmetros do /combine, na query string (url repetido)
+            data = {'urls': request.args.getlist('url')}
+            for name in ('resample', 'fit'):
+                if name in request.args:
+                    data[name] = request.args[name]
+            for name in ('cols', 'rows', 'width', 'height'):
+                if name in request.args:
+                    value = request.args[name]
+                    if not value.isdigit():
+                        raise ValueError(f'Parâmetro "{name}" deve ser um inteiro')
+                    data[name] = int(value)
+            urls, resample, _, layout = parse_combine_request(data)
+            stream = combiner.open_stream(urls, resample, layout, fps)
+
+        # Libera o espectador no fim do gerador ou, se ele nunca começar, ao fechar a resposta
+        release = stream.releaser()
+        response = Response(_stream_parts(stream, release), mimetype='multipart/x-mixed-replace; boundary=frame')
+        response.call_on_close(release)
+        response.cache_control.no_store = True
+        # Evita que proxies (nginx/ingress) acumulem os quadros
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except StreamLimitReached as e:
+        return _busy_response(e)
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
+        ERRORS.labels('combine').inc()
         return jsonify({'error': f'Erro interno: {str(e)}'}), 500
 
+@app.route('/jobs/<key>', methods=['GET'])
+def get_job(key: str):
+    """Endpoint para consultar o status de uma renderização assíncrona"""
+    full_key = key if key.startswith('image_combiner:') else f'image_combiner:{key}'
+    status = combiner.get_job_status(full_key)
+    if status is None:
+        return jsonify({'error': 'Job não encontrado', 'key': key}), 404
+    return jsonify(status)
+
 @app.route('/config', methods=['GET'])
 def get_current_config():
     """Endpoint para mostrar configuração atual"""
@@ -463,34 +4262,84 @@ def get_current_config():
         return jsonify({
             'config_source': 'Home Assistant options.json' if os.path.exists('/data/options.json') else 'Environment variables',
             'image_settings': {
-                'max_images': combiner.max_images,
-                'image_quality': combiner.image_quality,
-                'cell_width': combiner.cell_width,
-                'cell_height': combiner.cell_height,
-                'timeout': combiner.timeout
+                'max_images': combiner.settings.max_images,
+                'max_batch_size': combiner.settings.max_batch_size,
+                'image_quality': combiner.settings.image_quality,
+                'cell_width': combiner.settings.cell_width,
+                'cell_height': combiner.settings.cell_height,
+                'timeout': combiner.settings.timeout,
+                'resample': combiner.settings.resample,
+                'output_format': combiner.settings.output_format,
+                'jpeg_mode': combiner.settings.jpeg_mode,
+                'available_formats': available_formats()
             },
             'redis_settings': {
                 'host': current_config.get('redis_host', 'localhost'),
                 'port': current_config.get('redis_port', 6379),
                 'password_set': bool(current_config.get('redis_password', '')),
                 'cache_ttl': current_config.get('cache_ttl', 600),
+                'memory_cache_mb': current_config.get('memory_cache_mb', 32),
+                'cache_codec': current_config.get('cache_codec', 'auto'),
+                'timeout_ms': current_config.get('redis_timeout_ms', 1000),
+                'max_connections': current_config.get('redis_max_connections', 16),
                 'enable_cache': current_config.get('enable_cache', True),
-                'redis_required': current_config.get('redis_required', True)
+                'redis_required': current_config.get('redis_required', True),
+                'cache_backend': current_config.get('cache_backend', 'redis'),
+                'disk_cache_dir': current_config.get('disk_cache_dir', '/data/cache'),
+                'disk_cache_mb': current_config.get('disk_cache_mb', 1024)
             },
             'cache_status': {
                 'enabled': combiner.cache.enabled,
-                'connected': combiner.cache.enabled and combiner.cache.redis_client is not None
+                'backend': combiner.cache.backend,
+                'connected': combiner.cache.redis_available,
+                'circuit': combiner.cache.breaker.get_stats()
+            },
+            'log_settings': {
+                'level': logging.getLevelName(logger.level).lower(),
+                'sample_rate': _access_sampler.rate
+            },
+            'reload': {
+                'hot_options': list(ImageCombiner.HOT_OPTIONS),
+                'last_reload': combiner.last_reload,
+                'pending_restart': combiner.pending_restart
             },
-            'raw_config': current_config
+            'raw_config': redact_config(current_config)
         })
         
     except Exception as e:
         return jsonify({'error': f'Erro ao obter configuração: {str(e)}'}), 500
 
+@app.route('/config/reload', methods=['POST'])
+def reload_config():
+    """Relê as opções e aplica as recarregáveis sem reiniciar (só neste worker)"""
+    try:
+        result = combiner.reload_config()
+    except Exception as e:
+        return jsonify({'error': f'Erro ao recarregar configuração: {str(e)}'}), 400
+    return jsonify(result)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint de métricas no formato Prometheus"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Agrega as métricas de todos os workers do gunicorn
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
 @app.route('/cache/stats', methods=['GET'])
 def cache_stats():
     """Endpoint para estatísticas do cache"""
     stats = combiner.cache.get_cache_stats()
+    stats['source_cache'] = combiner.source_cache.get_stats()
+    stats['tile_cache'] = combiner.get_tile_stats()
+    stats['encode'] = combiner.get_encode_stats()
+    stats['coalesced_requests'] = {
+        'local': combiner.single_flight.coalesced,
+        'remote': combiner.coalesced_remote
+    }
     return jsonify(stats)
 
 @app.route('/cache/clear', methods=['POST'])
@@ -499,11 +4348,14 @@ def clear_cache():
     try:
         if not combiner.cache.enabled:
             return jsonify({'error': 'Cache não está habilitado'}), 400
+        if combiner.cache.redis_client is not None and not combiner.cache.redis_available:
+            return jsonify({'error': 'Redis indisponível (circuito aberto), tente novamente mais tarde'}), 503
         
-        # Remove todas as chaves do cache do image combiner
-        keys = combiner.cache.redis_client.keys("image_combiner:*")
-        if keys:
-            deleted = combiner.cache.redis_client.delete(*keys)
+        # Remove todas as chaves do cache do image combiner (SCAN + UNLINK em lotes).
+        # Os caches em memória (L1, origens e células) são descartados neste
+        # processo e, pela nova geração do cache, nos demais workers
+        deleted = combiner.cache.clear()
+        if deleted:
             return jsonify({
                 'message': f'{deleted} chaves removidas do cache',
                 'deleted_keys': deleted
@@ -519,20 +4371,51 @@ def health_check():
     """Endpoint de health check"""
     cache_stats = combiner.cache.get_cache_stats()
     
+    # Redis fora do ar não derruba o serviço: as imagens são renderizadas sem
+    # cache (ou só com o cache em disco, no backend disk+redis). Enquanto os
+    # backends conectam o status é "starting"; a resposta é sempre 200 (o
+    # processo está vivo), a prontidão fica em /ready.
+    readiness = combiner.readiness()
+    degraded = combiner.cache.redis_client is not None and not combiner.cache.redis_available
+    if readiness['ready']:
+        status = 'degraded' if degraded else 'healthy'
+    elif readiness['cache']['redis'] == 'connecting' or readiness['cpu_pool'] == 'warming':
+        status = 'starting'
+    else:
+        status = 'degraded'
+    
     return jsonify({
-        'status': 'healthy', 
+        'status': status,
+        'ready': readiness['ready'],
+        'readiness': readiness,
         'service': 'Image Combiner',
         'version': '1.1.2',
         'config': {
-            'max_images': combiner.max_images,
-            'image_quality': combiner.image_quality,
-            'cell_dimensions': f'{combiner.cell_width}x{combiner.cell_height}',
-            'timeout': combiner.timeout
+            'max_images': combiner.settings.max_images,
+            'image_quality': combiner.settings.image_quality,
+            'cell_dimensions': f'{combiner.settings.cell_width}x{combiner.settings.cell_height}',
+            'timeout': combiner.settings.timeout
         },
         'cache': cache_stats,
-        'features': ['key_based_retrieval', 'redis_cache', 'gzip_compression']
+        'redis': {
+            'enabled': combiner.cache.redis_client is not None,
+            'available': combiner.cache.redis_available,
+            'circuit': combiner.cache.breaker.get_stats() if combiner.cache.redis_client is not None else None
+        },
+        'render_queue': combiner.render_queue.get_stats(),
+        'cpu_pool': combiner.cpu_pool.get_stats() if combiner.cpu_pool is not None else None,
+        'decode_budget': combiner.decode_budget.get_stats() if combiner.decode_budget is not None else None,
+        'streams': combiner.get_stream_stats(),
+        'features': ['key_based_retrieval', 'redis_cache', 'cache_codec', 'async_render', 'cpu_pool', 'mjpeg_stream',
+                     'hot_reload']
     })
 
+@app.route('/ready', methods=['GET'])
+def ready_check():
+    """Prontidão: 200 com os backends conectados e o pool de CPU aquecido, 503 antes disso"""
+    readiness = combiner.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
 @app.route('/', methods=['GET'])
 def home():
     """Endpoint de informações da API"""
@@ -542,21 +4425,29 @@ def home():
         'home_assistant_addon': True,
         'features': ['image_combination', 'redis_cache', 'compression', 'key_based_retrieval'],
         'config': {
-            'max_images': combiner.max_images,
-            'image_quality': combiner.image_quality,
-            'cell_width': combiner.cell_width,
-            'cell_height': combiner.cell_height,
-            'timeout': combiner.timeout,
+            'max_images': combiner.settings.max_images,
+            'image_quality': combiner.settings.image_quality,
+            'cell_width': combiner.settings.cell_width,
+            'cell_height': combiner.settings.cell_height,
+            'timeout': combiner.settings.timeout,
             'cache_enabled': combiner.cache.enabled,
             'cache_ttl': combiner.cache.ttl if combiner.cache.enabled else None
         },
         'endpoints': {
             'POST /combine': 'Combina imagens e retorna chave única (JSON response)',
+            'POST /combine/batch': 'Combina vários conjuntos de imagens em uma requisição (downloads compartilhados)',
             'GET /image/<key>': 'Recupera imagem usando chave única',
+            'GET /jobs/<key>': 'Status de uma renderização assíncrona',
             'GET /config': 'Mostra configuração atual em tempo real',
+            'POST /config/reload': 'Recarrega as opções deste worker sem reiniciar (todos recarregam quando options.json muda)',
             'GET /cache/stats': 'Estatísticas do cache Redis',
+            'GET /combos': 'Lista os combos nomeados configurados',
+            'GET /combo/{name}': 'Imagem de um combo nomeado (renovada em segundo plano)',
+            'GET /stream': 'Transmissão MJPEG ao vivo de uma combinação (?url=...&url=...&fps=2 ou ?combo=<nome>)',
+            'GET /metrics': 'Métricas Prometheus (latência por etapa, hits/misses, bytes)',
             'POST /cache/clear': 'Limpa o cache Redis',
             'GET /health': 'Health check do serviço',
+            'GET /ready': 'Prontidão (200 com os backends conectados, 503 enquanto inicializa)',
             'GET /': 'Informações da API'
         },
         'usage': {
@@ -565,7 +4456,15 @@ def home():
                 'url': '/combine',
                 'content_type': 'application/json',
                 'body': {
-                    'urls': ['url1', 'url2', 'url3', 'url4']
+                    'urls': ['url1', 'url2', 'url3', 'url4'],
+                    'resample': 'fast | balanced | best (opcional)',
+                    'async': 'true | false (opcional)',
+                    'format': 'auto | jpeg | webp | avif (opcional)',
+                    'cols': 'colunas da grade (opcional)',
+                    'rows': 'linhas da grade (opcional)',
+                    'width': 'largura da imagem final (opcional)',
+                    'height': 'altura da imagem final (opcional)',
+                    'fit': 'contain | cover (opcional)'
                 },
                 'response': {
                     'success': True,
@@ -580,39 +4479,21 @@ def home():
             'retrieve': {
                 'method': 'GET',
                 'url': '/image/{key}',
-                'response': 'Imagem JPEG combinada'
+                'response': 'Imagem combinada (JPEG, ou WebP/AVIF conforme Accept quando a variante existir)'
             }
         }
     })
 
 if __name__ == '__main__':
-    import logging
-    import os
-    
-    # Suprimir avisos do Werkzeug (servidor Flask de desenvolvimento)
-    log = logging.getLogger('werkzeug')
-    log.setLevel(logging.ERROR)
-    
-    # Log startup information
-    print(f"🚀 Starting Image Combiner API v1.1.2")
-    print(f"📊 Image Configuration:")
-    print(f"   - Max images: {combiner.max_images}")
-    print(f"   - Image quality: {combiner.image_quality}")
-    print(f"   - Cell dimensions: {combiner.cell_width}x{combiner.cell_height}")
-    print(f"   - Timeout: {combiner.timeout}s")
-    print(f"💾 Cache Configuration:")
-    print(f"   - Enabled: {'Yes' if combiner.cache.enabled else 'No'}")
-    if combiner.cache.enabled:
-        print(f"   - TTL: {combiner.cache.ttl}s")
-        print(f"   - Compression: gzip level 6")
-    print(f"🔑 Features:")
-    print(f"   - Key-based image retrieval")
-    print(f"   - JSON response with unique keys")
-    print(f"🌐 Server starting on http://0.0.0.0:5000")
+    # Modo de desenvolvimento: servidor Flask (Werkzeug) em um único processo.
+    # Em produção o run.sh inicia o gunicorn com gunicorn.conf.py.
+    init_combiner()
+    log_startup_info()
+    logger.info("🌐 Development server starting on http://0.0.0.0:5000")
     
     # Detecta se está rodando no Home Assistant
     is_addon = os.getenv('HASSIO_TOKEN') is not None
     if is_addon:
-        print("🏠 Running as Home Assistant Addon")
+        logger.info("🏠 Running as Home Assistant Addon")
     
-    app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
+    app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Benchmark do Image Combiner
+
+Executa cenários de carga contra o app em processo (cliente de teste do Flask),
+com câmeras simuladas locais e um Redis local ou substituto em memória
+(fakeredis). Cada cenário roda em um processo próprio para que o pico de RSS
+seja medido isoladamente.
+
+Uso:
+    python benchmarks/bench.py                       # roda e compara com baseline.json
+    python benchmarks/bench.py --save                # regrava o baseline
+    python benchmarks/bench.py --scenario miss-4k-c1 --requests 20
+    python benchmarks/bench.py --redis server        # usa redis-server local
+
+Sai com código 1 se algum cenário regredir além da tolerância.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+
+@dataclass
+class Scenario:
+    name: str
+    endpoint: str = 'combine'     # 'combine' ou 'image'
+    images: int = 4
+    resolution: str = '1080p'
+    source_format: str = 'jpeg'
+    latency: float = 0.0          # latência injetada em cada câmera (segundos)
+    hit_ratio: float = 0.0        # fração das requisições que reutilizam uma combinação já em cache
+    concurrency: int = 1
+    requests: int = 40
+
+
+SCENARIOS = [
+    Scenario('miss-1080p-c1'),
+    Scenario('miss-4k-c1', resolution='4k', requests=20),
+    Scenario('miss-1080p-png-c1', source_format='png', requests=20),
+    Scenario('miss-1080p-latency-c8', latency=0.05, concurrency=8),
+    Scenario('mixed-1080p-c8', hit_ratio=0.8, concurrency=8, requests=200),
+    Scenario('hit-combine-c8', hit_ratio=1.0, concurrency=8, requests=400),
+    Scenario('hit-image-c8', endpoint='image', hit_ratio=1.0, concurrency=8, requests=400),
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil pelo método nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ---------------------------------------------------------------------------
+# Redis
+# ---------------------------------------------------------------------------
+
+def resolve_redis_mode(mode: str) -> str:
+    if mode != 'auto':
+        return mode
+    if shutil.which('redis-server'):
+        return 'server'
+    try:
+        import fakeredis  # noqa: F401
+        return 'fake'
+    except ImportError:
+        raise SystemExit(
+            "Nenhum Redis disponível: instale redis-server ou "
+            "`pip install -r benchmarks/requirements.txt` (fakeredis)"
+        )
+
+
+@contextlib.contextmanager
+def redis_server():
+    """Sobe um redis-server descartável, sem persistência, em uma porta livre"""
+    port = free_port()
+    proc = subprocess.Popen(
+        ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            with contextlib.suppress(OSError):
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            time.sleep(0.05)
+        else:
+            raise SystemExit("redis-server não respondeu")
+        yield '127.0.0.1', port
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def install_fakeredis():
+    """Troca redis.Redis por um FakeRedis em memória compartilhado pelo processo"""
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    class BenchRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            for option in ('host', 'port', 'password', 'socket_connect_timeout', 'socket_timeout', 'connection_pool'):
+                kwargs.pop(option, None)
+            super().__init__(*args, server=server, **kwargs)
+
+        def info(self, *args, **kwargs):
+            # fakeredis não implementa INFO
+            return {'used_memory_human': '0B', 'connected_clients': 1}
+
+    redis.Redis = BenchRedis
+
+
+# ---------------------------------------------------------------------------
+# Execução de um cenário (processo filho)
+# ---------------------------------------------------------------------------
+
+def run_scenario(scenario: Scenario, redis_mode: str, redis_address: Optional[tuple]) -> Dict:
+    os.environ['ENABLE_CACHE'] = 'false' if redis_mode == 'none' else 'true'
+    os.environ['REDIS_REQUIRED'] = 'false' if redis_mode == 'none' else 'true'
+    os.environ.setdefault('MAX_IMAGES', str(max(4, scenario.images)))
+    if redis_address:
+        os.environ['REDIS_HOST'], port = redis_address
+        os.environ['REDIS_PORT'] = str(port)
+    if redis_mode == 'fake':
+        install_fakeredis()
+
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from cameras import CameraServer
+
+    cameras = CameraServer().start()
+    cameras.warm(scenario.resolution, scenario.source_format)
+
+    # Apenas avisos e erros do app, para não poluir a saída
+    os.environ.setdefault('LOG_LEVEL', 'warning')
+    import app as app_module
+    app_module.init_combiner()
+    if redis_mode != 'none':
+        app_module.combiner.cache.clear()
+
+    counter = iter(range(1, 10 ** 9))
+    counter_lock = threading.Lock()
+    local = threading.local()
+
+    def urls_for(n: int) -> List[str]:
+        return [
+            cameras.url(scenario.resolution, scenario.source_format, scenario.latency, n * 100 + i)
+            for i in range(scenario.images)
+        ]
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app_module.app.test_client()
+        return local.client
+
+    # Combinação "quente" usada pelas requisições que devem dar hit
+    warm = client().post('/combine', json={'urls': urls_for(0)})
+    if warm.status_code != 200:
+        raise RuntimeError(f"warm-up falhou: {warm.status_code} {warm.get_json()}")
+    warm_key = warm.get_json()['key']
+
+    rng = random.Random(42)
+    plan = [rng.random() < scenario.hit_ratio for _ in range(scenario.requests)]
+
+    def one(hit: bool) -> tuple:
+        if hit:
+            urls = urls_for(0)
+        else:
+            with counter_lock:
+                urls = urls_for(next(counter))
+        started = time.perf_counter()
+        if scenario.endpoint == 'image':
+            response = client().get(f'/image/{warm_key}')
+        else:
+            response = client().post('/combine', json={'urls': urls})
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code == 200
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=scenario.concurrency) as pool:
+        results = list(pool.map(one, plan))
+    wall = time.perf_counter() - wall_started
+
+    cameras.stop()
+    if app_module.combiner.cpu_pool is not None:
+        # Processos filhos do multiprocessing não executam o atexit do app
+        app_module.combiner.cpu_pool.shutdown(wait=True)
+    latencies = [elapsed for elapsed, ok in results if ok]
+    return {
+        'requests': scenario.requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        # ru_maxrss é em KiB no Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _child(scenario: Scenario, redis_mode: str, redis_address, results):
+    try:
+        results.put(('ok', run_scenario(scenario, redis_mode, redis_address)))
+    except BaseException as e:
+        results.put(('error', f"{type(e).__name__}: {e}"))
+
+
+def run_isolated(scenario: Scenario, redis_mode: str, redis_address) -> Dict:
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(scenario, redis_mode, redis_address, results))
+    proc.start()
+    status, payload = results.get()
+    proc.join()
+    if status != 'ok':
+        raise SystemExit(f"Cenário {scenario.name} falhou: {payload}")
+    return payload
+
+
+# ---------------------------------------------------------------------------
+# Baseline
+# ---------------------------------------------------------------------------
+
+def compare(current: Dict, baseline: Dict, tolerance: float, slack_ms: float) -> List[str]:
+    """Retorna a lista de regressões em relação ao baseline
+    
+    Latências só contam como regressão se também piorarem mais que slack_ms,
+    para que variações de poucos milissegundos nos cenários de hit não falhem.
+    """
+    failures = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['errors'] > base.get('errors', 0):
+            failures.append(f"{name}: {result['errors']} erros (baseline {base.get('errors', 0)})")
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            failures.append(
+                f"{name}: throughput {result['throughput_rps']} req/s < baseline {base['throughput_rps']}"
+            )
+        for metric in ('p95_ms', 'p99_ms'):
+            if result[metric] > base[metric] * (1 + tolerance) and result[metric] - base[metric] > slack_ms:
+                failures.append(f"{name}: {metric} {result[metric]} > baseline {base[metric]}")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            failures.append(f"{name}: peak_rss_mb {result['peak_rss_mb']} > baseline {base['peak_rss_mb']}")
+    return failures
+
+
+def print_table(results: Dict, baseline: Dict):
+    header = f"{'cenário':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>10}{'erros':>7}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print(
+            f"{name:<24}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+            f"{r['p99_ms']:>10}{r['peak_rss_mb']:>10}{r['errors']:>7}"
+        )
+        base = baseline.get(name)
+        if base:
+            print(
+                f"{'  baseline':<24}{base['throughput_rps']:>10}{base['p50_ms']:>10}{base['p95_ms']:>10}"
+                f"{base['p99_ms']:>10}{base['peak_rss_mb']:>10}{base.get('errors', 0):>7}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do Image Combiner')
+    parser.add_argument('--scenario', action='append', help='Cenário a executar (repetível; padrão: todos)')
+    parser.add_argument('--requests', type=int, help='Sobrescreve o número de requisições por cenário')
+    parser.add_argument('--redis', choices=['auto', 'server', 'fake', 'none'], default='auto',
+                        help='Redis local (server), fakeredis em processo (fake) ou sem cache (none)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Arquivo de baseline')
+    parser.add_argument('--save', action='store_true', help='Grava os resultados como novo baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Regressão tolerada em relação ao baseline (0.25 = 25%%)')
+    parser.add_argument('--slack-ms', type=float, default=25.0,
+                        help='Piora absoluta mínima de latência para contar como regressão')
+    parser.add_argument('--json', action='store_true', help='Imprime os resultados em JSON')
+    args = parser.parse_args()
+
+    known = {s.name: s for s in SCENARIOS}
+    selected = args.scenario or list(known)
+    unknown = [name for name in selected if name not in known]
+    if unknown:
+        parser.error(f"cenário desconhecido: {', '.join(unknown)} (disponíveis: {', '.join(known)})")
+
+    redis_mode = resolve_redis_mode(args.redis)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('scenarios', {})
+
+    results = {}
+    with contextlib.ExitStack() as stack:
+        redis_address = stack.enter_context(redis_server()) if redis_mode == 'server' else None
+        for name in selected:
+            scenario = known[name]
+            if args.requests:
+                scenario.requests = args.requests
+            print(f"▶ {name} ({asdict(scenario)})", file=sys.stderr)
+            results[name] = run_isolated(scenario, redis_mode, redis_address)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, {} if args.save else baseline)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'redis': redis_mode,
+                'python': sys.version.split()[0],
+                'cpus': os.cpu_count(),
+                'scenarios': results,
+            }, f, indent=2)
+            f.write('\n')
+        print(f"\n💾 Baseline gravado em {args.baseline}")
+        return
+
+    failures = compare(results, baseline, args.tolerance, args.slack_ms)
+    if failures:
+        print("\n❌ Regressões em relação ao baseline:")
+        for failure in failures:
+            print(f"   - {failure}")
+        sys.exit(1)
+    if baseline:
+        print(f"\n✅ Dentro da tolerância de {args.tolerance:.0%} em relação ao baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Câmeras simuladas para o benchmark do Image Combiner
+
+Servidor HTTP local que entrega imagens JPEG/PNG geradas de forma
+determinística, com resolução, formato e latência configuráveis pela URL:
+
+    /snapshot?w=1920&h=1080&fmt=jpeg&delay=0.05&n=42
+
+O parâmetro `n` identifica o quadro: URLs com `n` diferente têm conteúdo
+diferente (bytes extras depois do fim da imagem, ignorados pelo decodificador),
+como câmeras que mudam de quadro, com o mesmo custo de decodificação.
+"""
+
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlsplit, urlencode
+
+from PIL import Image
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+_fixtures: Dict[Tuple[int, int, str], bytes] = {}
+_fixtures_lock = threading.Lock()
+
+
+def render_fixture(width: int, height: int, fmt: str = 'jpeg', seed: int = 0) -> bytes:
+    """Gera (e memoriza) uma imagem de teste com textura parecida com a de uma câmera"""
+    key = (width, height, fmt)
+    with _fixtures_lock:
+        if key in _fixtures:
+            return _fixtures[key]
+
+    # Ruído determinístico em baixa resolução ampliado, misturado a um gradiente:
+    # comprime e decodifica de forma parecida com uma foto real
+    rng = random.Random(seed)
+    small = (max(1, width // 4), max(1, height // 4))
+    noise = Image.frombytes('RGB', small, rng.randbytes(small[0] * small[1] * 3))
+    noise = noise.resize((width, height), Image.BILINEAR)
+    gradient = Image.merge('RGB', [
+        Image.linear_gradient('L').resize((width, height)),
+        Image.linear_gradient('L').rotate(90).resize((width, height)),
+        Image.new('L', (width, height), 128),
+    ])
+    image = Image.blend(gradient, noise, 0.35)
+
+    buffer = io.BytesIO()
+    if fmt == 'png':
+        image.save(buffer, format='PNG', compress_level=6)
+    else:
+        image.save(buffer, format='JPEG', quality=90)
+    data = buffer.getvalue()
+
+    with _fixtures_lock:
+        _fixtures[key] = data
+    return data
+
+
+class CameraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        width = int(query.get('w', ['1920'])[0])
+        height = int(query.get('h', ['1080'])[0])
+        fmt = query.get('fmt', ['jpeg'])[0]
+        delay = float(query.get('delay', ['0'])[0])
+
+        if delay > 0:
+            time.sleep(delay)
+
+        frame = query.get('n', ['0'])[0]
+        body = render_fixture(width, height, fmt) + f"frame:{frame}".encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if fmt == 'png' else 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CameraServer:
+    """Servidor de câmeras simuladas rodando em uma thread"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), CameraHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'CameraServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, resolution: str = '1080p', fmt: str = 'jpeg', latency: float = 0.0, n: int = 0) -> str:
+        width, height = RESOLUTIONS[resolution]
+        params = {'w': width, 'h': height, 'fmt': fmt, 'n': n}
+        if latency:
+            params['delay'] = latency
+        return f"{self.base_url}/snapshot?{urlencode(params)}"
+
+    def warm(self, resolution: str, fmt: str):
+        """Gera a imagem antes da medição para não contar o custo do fixture"""
+        render_fixture(*RESOLUTIONS[resolution], fmt)
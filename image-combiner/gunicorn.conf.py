@@ -0,0 +1,80 @@
+# Configuração do gunicorn (modo de produção do Image Combiner)
+#
+# Os valores vêm das variáveis de ambiente exportadas pelo run.sh a partir
+# das opções do addon. Cada worker é um processo separado com o seu próprio
+# combinador e cliente Redis, criados depois do fork.
+import os
+import shutil
+import sys
+
+# Métricas Prometheus compartilhadas entre os workers: cada processo grava os
+# seus valores neste diretório e /metrics agrega todos. Precisa estar definido
+# antes de os workers importarem o app (prometheus_client lê na importação).
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/image-combiner-metrics')
+
+bind = '0.0.0.0:5000'
+workers = int(os.getenv('WORKERS', 2))
+threads = int(os.getenv('THREADS', 4))
+worker_class = 'gthread'
+
+# Fila de requisições (request_queue). O backlog do socket é só a fila do
+# kernel, de conexões ainda não aceitas: sozinho ele não limita o que os
+# workers gthread já aceitaram. worker_connections limita as conexões abertas
+# em cada worker (as `threads` em atendimento mais a sua parte da fila,
+# incluindo conexões keep-alive ociosas); acima disso o worker para de aceitar
+# e as novas conexões esperam no backlog, também limitado a request_queue.
+# Com o backlog cheio o kernel descarta novas conexões (o cliente tenta de
+# novo ou expira).
+request_queue = int(os.getenv('REQUEST_QUEUE', 64))
+worker_connections = threads + max(1, -(-request_queue // workers))
+backlog = request_queue
+
+# Um /combine pode levar até o timeout de download mais a renderização
+timeout = int(os.getenv('TIMEOUT', 10)) * 2 + 30
+graceful_timeout = 30
+keepalive = 5
+
+# Não carrega a aplicação no master: cada worker importa e inicializa a sua
+preload_app = False
+
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Descarta métricas de execuções anteriores
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    server.log.info(
+        "Image Combiner ready: %s workers x %s threads, up to %s connections per worker, "
+        "listen backlog %s (SIGHUP for graceful reload)",
+        workers, threads, worker_connections, backlog
+    )
+
+
+def post_worker_init(worker):
+    from app import init_combiner, log_startup_info
+
+    try:
+        init_combiner()
+    except SystemExit as e:
+        # Configuração inutilizável (ex.: diretório do cache em disco): encerra
+        # com o código de falha de boot para que o master pare em vez de
+        # reiniciar o worker indefinidamente. O Redis conecta em segundo plano
+        # e não impede o worker de subir (ver /ready)
+        worker.log.error(str(e))
+        sys.exit(3)
+    if worker.age == 1:
+        log_startup_info()
+
+
+def child_exit(server, worker):
+    # Remove o gauge de requisições em andamento do worker encerrado
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
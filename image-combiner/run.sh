@@ -6,6 +6,11 @@ IMAGE_QUALITY=$(bashio::config 'image_quality')
 CELL_WIDTH=$(bashio::config 'cell_width')
 CELL_HEIGHT=$(bashio::config 'cell_height')
 TIMEOUT=$(bashio::config 'timeout')
+SERVER_MODE=$(bashio::config 'server_mode')
+WORKERS=$(bashio::config 'workers')
+THREADS=$(bashio::config 'threads')
+REQUEST_QUEUE=$(bashio::config 'request_queue')
+LOG_LEVEL=$(bashio::config 'log_level')
 
 # Export environment variables for the Python app
 export MAX_IMAGES
@@ -13,6 +18,10 @@ export IMAGE_QUALITY
 export CELL_WIDTH
 export CELL_HEIGHT
 export TIMEOUT
+export WORKERS
+export THREADS
+export REQUEST_QUEUE
+export LOG_LEVEL
 
 # Log configuration
 bashio::log.info "Starting Image Combiner addon..."
@@ -20,7 +29,14 @@ bashio::log.info "Max images: ${MAX_IMAGES}"
 bashio::log.info "Image quality: ${IMAGE_QUALITY}"
 bashio::log.info "Cell dimensions: ${CELL_WIDTH}x${CELL_HEIGHT}"
 bashio::log.info "Timeout: ${TIMEOUT}s"
+bashio::log.info "Server mode: ${SERVER_MODE}"
 
 # Start the Python application
 cd /app
-exec python3 app.py
+if [ "${SERVER_MODE}" = "development" ]; then
+    bashio::log.warning "Using the Flask development server (not for production use)"
+    exec python3 app.py
+fi
+
+bashio::log.info "Workers: ${WORKERS} x ${THREADS} threads, request queue: ${REQUEST_QUEUE}"
+exec gunicorn --config /app/gunicorn.conf.py app:app